@@ -2,7 +2,7 @@
 import click
 import yaml
 
-from pa_legislature import PALegislatureDB, Chamber
+from pa_legislature import PALegislatureDB, Chamber, NAMED_VOTES
 from names import dict_to_name
 
 if __name__ == '__main__':
@@ -19,24 +19,21 @@ if __name__ == '__main__':
                             clause_d['first'], clause_d['last'] = last.split(' ')
                         else:
                             clause_d['last'] = last
-                        existing_query = 'SELECT * FROM service LEFT JOIN members ON service.member_id == members.id '
-                        existing_query += db.generate_clause(clause_d)
-                        existing_matches = list(db.query(existing_query))
+                        table = 'service LEFT JOIN members ON service.member_id == members.id'
+                        existing_matches = list(db.select(table, clause=clause_d))
                         if edit is None:
                             if len(existing_matches) == 1:
                                 mid = existing_matches[0]['id']
                                 click.secho(f'Removing service for {last} ({chamber_s} {key})', fg='blue')
-                                clause = db.generate_clause({'member_id': mid, 'year': key, 'chamber': chamber})
-                                db.execute('DELETE FROM service ' + clause)
+                                db.delete('service', {'member_id': mid, 'year': key, 'chamber': chamber})
                             elif existing_matches:
                                 click.secho(f'Too many matches for {last} ({chamber_s} {key})', fg='yellow')
                         # Add in
                         elif not existing_matches:
                             # Need to add one in, find in year before or after
-                            query = 'SELECT * FROM service LEFT JOIN members ON service.member_id == members.id '
-                            query += f'WHERE last == "{last}" AND chamber={chamber.value} '
-                            query += f'AND (year == {key - 1} OR year == {key + 1})'
-                            matches = list(db.query(query))
+                            table = 'service LEFT JOIN members ON service.member_id == members.id'
+                            clause = {'last': last, 'chamber': chamber, 'year': [key - 1, key + 1]}
+                            matches = list(db.select(table, clause=clause))
                             if len(matches) == 1:
                                 match = matches[0]
                                 mid = match['id']
@@ -53,27 +50,28 @@ if __name__ == '__main__':
                                 click.secho(f'No match for {last} ({chamber_s} {key}) (id={mid})', fg='yellow')
             elif key == 'Votes':
                 for before, v in edits[key].items():
+                    collisions = []
                     if isinstance(v, str):
                         after = v
-                        votes = list(db.lookup_all('roll_id', 'votes', {'name': before}))
-                        if votes:
-                            click.secho(f'Replacing {len(votes):4d} votes by "{before}" with "{after}"', fg='blue')
-                            cmd = f'UPDATE votes SET name=? WHERE name="{before}"'
-                            db.execute(cmd, [after])
+                        n_votes = db.count(NAMED_VOTES, {'name': before})
+                        if n_votes:
+                            click.secho(f'Replacing {n_votes:4d} votes by "{before}" with "{after}"', fg='blue')
+                            collisions = db.rename_vote_name(before, after)
                     else:
                         after = v['name']
-                        table = 'votes LEFT JOIN roll_calls ON votes.roll_id=roll_calls.id'
-                        clause = f'WHERE votes.name == "{before}" AND stamp > "{v["start"]}" AND stamp < "{v["stop"]}"'
-                        roll_ids = list(db.lookup_all('id', table, clause))
+                        table = f'{NAMED_VOTES} LEFT JOIN roll_calls ON votes.roll_id=roll_calls.id'
+                        clause = 'WHERE vote_names.name == ? AND stamp > ? AND stamp < ?'
+                        roll_ids = list(db.lookup_all('roll_calls.id', table, clause,
+                                                      params=[before, v['start'], v['stop']]))
                         if roll_ids:
                             click.secho(f'Replacing {len(roll_ids):4d} votes by "{before}" with "{after}"', fg='blue')
-                            for roll_id in roll_ids:
-                                print(roll_id)
-                                cmd = f'UPDATE votes SET name=? WHERE name="{before}" AND roll_id={roll_id}'
-                                db.execute(cmd, [after])
+                            collisions = db.rename_vote_name(before, after, roll_ids)
+                    if collisions:
+                        click.secho(f'\tKept {len(collisions)} votes by "{before}" on rolls where "{after}" also voted '
+                                    f'(roll ids {", ".join(map(str, collisions))})', fg='yellow')
             elif key == 'Rename':
                 for d in edits[key]:
-                    member = db.query_one('SELECT * FROM members ' + db.generate_clause(d['from']))
+                    member = db.select_one('members', clause=d['from'])
                     if member is None:
                         click.secho(f'Could not find member: {d["from"]}', fg='yellow')
                         continue
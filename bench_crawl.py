@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+import argparse
+import click
+import collections
+import contextlib
+import io
+import os
+import pathlib
+import runpy
+import shutil
+import sys
+import tempfile
+import time
+
+from pa_legislature import PALegislatureDB
+from replay import ReplayArchive, start_server
+
+REPO_FOLDER = pathlib.Path(__file__).resolve().parent
+WRITE_METHODS = ['execute', 'execute_many', 'write']
+
+
+def time_methods(cls, names, totals):
+    for name in names:
+        def timed(self, *args, _method=getattr(cls, name), _name=name, **kwargs):
+            start = time.perf_counter()
+            try:
+                return _method(self, *args, **kwargs)
+            finally:
+                totals[_name] += time.perf_counter() - start
+        setattr(cls, name, timed)
+
+
+def rate(count, seconds):
+    return count / seconds if seconds else 0.0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time a full crawl against a recorded archive (see crawl.py --record)')
+    parser.add_argument('archive')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Show the output of the crawl')
+    parser.add_argument('crawl_args', nargs='*', help='Extra arguments for crawl.py, after --')
+    args = parser.parse_args()
+
+    archive = ReplayArchive(args.archive)
+    server = start_server(archive)
+    write_times = collections.Counter()
+    time_methods(PALegislatureDB, WRITE_METHODS, write_times)
+
+    with tempfile.TemporaryDirectory() as folder:
+        shutil.copy(REPO_FOLDER / 'pa_legislature.yaml', folder)
+        os.chdir(folder)
+
+        sys.argv = ['crawl.py', '-a', '--no-cache', '--replay', server.url] + args.crawl_args
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        start = time.perf_counter()
+        with output:
+            runpy.run_path(str(REPO_FOLDER / 'crawl.py'), run_name='__main__')
+        elapsed = time.perf_counter() - start
+
+        with PALegislatureDB() as db:
+            rolls = db.count('roll_calls', 'WHERE last_crawl IS NOT NULL')
+            votes = db.count('votes')
+
+    roll_hits = [hit for hit in server.hits if 'rc_view_action2' in hit[2]]
+    roll_seconds = roll_hits[-1][0] - roll_hits[0][0] if len(roll_hits) > 1 else elapsed
+    db_time = sum(write_times.values())
+
+    click.secho(f'Crawl args:     {" ".join(sys.argv[1:])}', fg='bright_white')
+    click.secho(f'Elapsed:        {elapsed:8.2f} s')
+    click.secho(f'Pages:          {len(server.hits):8d} ({rate(len(server.hits), elapsed):.1f} pages/s, '
+                f'{sum(hit[3] for hit in server.hits) / 1024 / 1024:.1f} MB)')
+    click.secho(f'Rolls:          {rolls:8d} ({rate(len(roll_hits), roll_seconds):.1f} rolls/s, {votes} votes)')
+    click.secho(f'DB write time:  {db_time:8.2f} s ({100 * db_time / elapsed:.0f}% of elapsed)')
@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+import argparse
+import click
+import collections
+import contextlib
+import io
+import os
+import pathlib
+import tempfile
+import time
+import tracemalloc
+
+from bench_schema import populate, write_yaml
+from dump import get_session_days, get_ordered_rolls, get_path, write_csv, export_slice
+from pa_legislature import PALegislatureDB, NAMED_VOTES
+
+
+def export_whole_history(db):
+    """The export as dump.py did it before it streamed: every matched vote, member and roll is loaded up front"""
+    vote_lookup = collections.defaultdict(dict)
+    for d in db.query(f'SELECT roll_id, member_id, vote FROM {NAMED_VOTES} WHERE member_id IS NOT NULL'):
+        vote_lookup[d['roll_id']][d['member_id']] = d['vote']
+    member_lookup = {d['id']: dict(d) for d in db.query('SELECT * FROM members')}
+    rolls_by_day = collections.defaultdict(list)
+    for d in db.query('SELECT * FROM roll_calls'):
+        rolls_by_day[d['day_id']].append(d)
+
+    for (year, chamber), days in sorted(get_session_days(db).items()):
+        rolls = get_ordered_rolls(days, rolls_by_day)
+        services = []
+        for service in db.select('service', clause={'year': year, 'chamber': chamber}, order='district'):
+            services.append(dict(member_lookup[service['member_id']], **dict(service)))
+        fn = get_path(year, chamber)
+        fn.parent.mkdir(parents=True, exist_ok=True)
+        write_csv(fn, ((roll, vote_lookup[roll['id']]) for roll in rolls), services)
+
+
+def export_streaming(db):
+    """The export as dump.py does it now, one (year, chamber) slice at a time"""
+    for (year, chamber), days in sorted(get_session_days(db).items()):
+        get_path(year, chamber).parent.mkdir(parents=True, exist_ok=True)
+        export_slice(db, year, chamber, sorted({day['session_id'] for day in days}))
+
+
+def measure(method, db):
+    """Return the peak of the memory allocated by Python during method(db) in MB, and the time it took.
+
+    SQLite's own page cache is not included, and is the same either way"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    method(db)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024 / 1024, seconds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the peak memory of the export with everything loaded up '
+                                                 'front and streamed one slice at a time')
+    parser.add_argument('-y', '--years', type=int, default=4)
+    parser.add_argument('-r', '--rolls', type=int, default=500, help='Roll calls per year and chamber')
+    parser.add_argument('-d', '--days', type=int, default=40, help='Session days per year and chamber')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_folder:
+        folder = pathlib.Path(temp_folder)
+        write_yaml(folder, with_layout=True)
+        cwd = os.getcwd()
+        os.chdir(folder)
+        click.secho('Generating data...', fg='bright_black')
+        with contextlib.redirect_stdout(io.StringIO()), PALegislatureDB() as db:
+            n_votes = populate(db, args.years, args.rolls, args.days, matched=True)
+
+        results = {}
+        with contextlib.redirect_stdout(io.StringIO()), PALegislatureDB(read_only=True) as db:
+            for label, method in [('whole history', export_whole_history), ('streaming', export_streaming)]:
+                results[label] = measure(method, db)
+        os.chdir(cwd)
+
+    click.secho(f'{args.years} years, {n_votes} votes. Peak Python memory of a full export (with tracemalloc):',
+                fg='bright_white')
+    click.secho(f'{"":16s} {"MB":>8s} {"seconds":>8s}', fg='bright_white')
+    for label, (peak, seconds) in results.items():
+        click.secho(f'{label:16s} {peak:8.1f} {seconds:8.2f}')
@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+import argparse
+import click
+import contextlib
+import datetime
+import io
+import os
+import pathlib
+import random
+import tempfile
+import time
+
+from bench_schema import populate, write_yaml
+from pa_legislature import PALegislatureDB
+
+ROLL_KEY = ['chamber', 'session_year', 'session_index', 'number']
+
+# (table, fields, clause) of the lookups that the crawl makes for every roll
+HOT_SELECTS = {
+    'votes by roll_id': ('votes', ['name_id', 'vote'], lambda roll: {'roll_id': roll['id']}),
+    'session_days by id': ('session_days', ['session_id'], lambda roll: {'id': roll['day_id']}),
+    'roll_calls by number': ('roll_calls', ['id'], lambda roll: {key: roll[key] for key in ROLL_KEY}),
+    'resolutions by url': ('resolutions', ['resolved'], lambda roll: {'url': f'https://example.com/{roll["id"]}'}),
+}
+
+
+def run_inline(db, rolls):
+    """Values formatted into the SQL, as MetroDB.generate_clause does"""
+    times = {}
+    for label, (table, fields, get_clause) in HOT_SELECTS.items():
+        start = time.perf_counter()
+        for roll in rolls:
+            db.execute(db.generate_select_query(table, fields, get_clause(roll))).fetchall()
+        times[label] = time.perf_counter() - start
+
+    now = datetime.datetime.now()
+    start = time.perf_counter()
+    for roll in rolls:
+        db.execute('UPDATE roll_calls SET last_crawl=? ' + db.generate_clause({'id': roll['id']}), [now])
+    times['roll_calls update'] = time.perf_counter() - start
+    return times
+
+
+def run_parameterized(db, rolls):
+    """The same statements with placeholders, via PALegislatureDB.build_select/build_clause"""
+    times = {}
+    for label, (table, fields, get_clause) in HOT_SELECTS.items():
+        start = time.perf_counter()
+        for roll in rolls:
+            db.execute(*db.build_select(table, fields, get_clause(roll))).fetchall()
+        times[label] = time.perf_counter() - start
+
+    now = datetime.datetime.now()
+    start = time.perf_counter()
+    for roll in rolls:
+        clause, params = db.build_clause({'id': roll['id']})
+        db.execute('UPDATE roll_calls SET last_crawl=? ' + clause, [now] + params)
+    times['roll_calls update'] = time.perf_counter() - start
+    return times
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the per-roll statements with values inlined into the SQL '
+                                                 'and with placeholders')
+    parser.add_argument('-y', '--years', type=int, default=4)
+    parser.add_argument('-r', '--rolls', type=int, default=500, help='Roll calls per year and chamber')
+    parser.add_argument('-d', '--days', type=int, default=40, help='Session days per year and chamber')
+    parser.add_argument('-n', '--repeats', type=int, default=3, help='Passes over all the rolls, keeping the best')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_folder:
+        folder = pathlib.Path(temp_folder)
+        write_yaml(folder, with_layout=True)
+        cwd = os.getcwd()
+        os.chdir(folder)
+        click.secho('Generating data...', fg='bright_black')
+        with contextlib.redirect_stdout(io.StringIO()), PALegislatureDB() as db:
+            populate(db, args.years, args.rolls, args.days)
+            rolls = list(db.query('SELECT * FROM roll_calls'))
+            random.Random(0).shuffle(rolls)
+
+            before = {}
+            after = {}
+            for i in range(args.repeats):
+                for results, method in [(before, run_inline), (after, run_parameterized)]:
+                    for label, seconds in method(db, rolls).items():
+                        results[label] = min(seconds, results.get(label, seconds))
+        os.chdir(cwd)
+
+    click.secho(f'{len(rolls)} rolls, best of {args.repeats}. Microseconds per statement:', fg='bright_white')
+    click.secho(f'{"":24s} {"inline":>10s} {"params":>10s} {"speedup":>8s}', fg='bright_white')
+    for label in before:
+        click.secho(f'{label:24s} {1e6 * before[label] / len(rolls):10.1f} {1e6 * after[label] / len(rolls):10.1f} '
+                    f'{before[label] / after[label]:7.1f}x')
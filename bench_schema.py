@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+import argparse
+import click
+import contextlib
+import datetime
+import io
+import itertools
+import os
+import pathlib
+import random
+import runpy
+import shutil
+import sys
+import tempfile
+import time
+import yaml
+
+from pa_legislature import PALegislatureDB, Chamber, Vote
+
+REPO_FOLDER = pathlib.Path(__file__).resolve().parent
+LAYOUT_KEYS = ['unique_keys', 'without_rowid', 'indexes']
+CHAMBER_SIZES = {Chamber.HOUSE: 203, Chamber.SENATE: 50}
+SYLLABLES = ['ba', 'ce', 'di', 'fo', 'gu', 'ha', 'ki', 'lo', 'mu', 'na', 'pe', 'ri', 'so', 'tu', 'vi', 'ze']
+
+# The lookups that the schema is meant to speed up, with parameters drawn from the generated data
+POINT_QUERIES = {
+    'votes by roll_id': ('SELECT * FROM votes WHERE roll_id=?', 'SELECT id FROM roll_calls'),
+    'votes by name_id': ('SELECT * FROM votes WHERE name_id=?', 'SELECT id FROM vote_names'),
+    'rolls by day_id': ('SELECT * FROM roll_calls WHERE day_id=?', 'SELECT id FROM session_days'),
+    'service by year, chamber': ('SELECT * FROM service WHERE year=? AND chamber=?',
+                                 'SELECT DISTINCT year, chamber FROM service'),
+    'members by archive id': ('SELECT * FROM members WHERE house_archive_id=?',
+                              'SELECT house_archive_id FROM members WHERE house_archive_id IS NOT NULL'),
+}
+
+
+def write_yaml(folder, with_layout):
+    structure = yaml.safe_load(open(REPO_FOLDER / 'pa_legislature.yaml'))
+    if not with_layout:
+        for key in LAYOUT_KEYS:
+            structure.pop(key, None)
+        # The crawl_status and export_versions triggers upsert on these keys, so they are not optional
+        structure['unique_keys'] = {'crawl_status': ['year', 'chamber'], 'export_versions': ['year', 'chamber']}
+    with open(folder / 'pa_legislature.yaml', 'w') as f:
+        yaml.safe_dump(structure, f)
+
+
+def populate(db, years, rolls_per_year, days_per_year, matched=False):
+    """Fill the database with fully crawled synthetic sessions, where every vote name matches one member.
+
+    If matched, the vote names already have their member_ids, as if match_names.py had been run"""
+    rng = random.Random(0)
+    names = iter(''.join(t).title() for t in itertools.product(SYLLABLES, repeat=3))
+    now = datetime.datetime.now()
+
+    members = []
+    member_ids = {}
+    for chamber, size in CHAMBER_SIZES.items():
+        prefix = 'house_' if chamber == Chamber.HOUSE else 'senate_'
+        member_ids[chamber] = []
+        for i in range(size):
+            member_id = len(members) + 1
+            members.append({'id': member_id, f'{prefix}archive_id': member_id, 'first': 'John', 'last': next(names),
+                            'last_crawl': now})
+            member_ids[chamber].append(member_id)
+    for member in members:
+        db.insert('members', member)
+    last_names = {member['id']: member['last'] for member in members}
+
+    sessions, days, rolls, service, vote_names, votes = [], [], [], [], [], []
+    for year in range(2000, 2000 + years):
+        for chamber in Chamber:
+            session_id = len(sessions) + 1
+            sessions.append((session_id, chamber, year, 0, f'{year} Regular Session', now))
+            day_ids = []
+            for i in range(days_per_year):
+                day_ids.append(len(days) + 1)
+                days.append((day_ids[-1], session_id, datetime.date(year, 1, 1) + datetime.timedelta(days=i), now))
+            name_ids = []
+            for district, member_id in enumerate(member_ids[chamber], 1):
+                service.append((member_id, year, chamber, district, rng.choice(['Democrat', 'Republican'])))
+                name_ids.append(len(vote_names) + 1)
+                vote_names.append((name_ids[-1], session_id, last_names[member_id].upper(),
+                                   member_id if matched else None))
+            for number in range(1, rolls_per_year + 1):
+                roll_id = len(rolls) + 1
+                day_id = day_ids[(number - 1) * days_per_year // rolls_per_year]
+                stamp = datetime.datetime(year, 1, 1, 12) + datetime.timedelta(days=day_id - day_ids[0])
+                rolls.append((roll_id, day_id, year, 0, chamber, number, f'HB {number} Final Passage', stamp, now))
+                for name_id in name_ids:
+                    votes.append((roll_id, name_id, rng.choice(list(Vote))))
+
+    db.bulk_insert('sessions', ['id', 'chamber', 'year', 'session_index', 'name', 'last_crawl'], sessions)
+    db.bulk_insert('session_days', ['id', 'session_id', 'date', 'last_crawl'], days)
+    db.bulk_insert('roll_calls', ['id', 'day_id', 'session_year', 'session_index', 'chamber', 'number', 'name',
+                                  'stamp', 'last_crawl'], rolls)
+    db.bulk_insert('service', ['member_id', 'year', 'chamber', 'district', 'party'], service)
+    db.bulk_insert('vote_names', ['id', 'session_id', 'name', 'member_id'], vote_names)
+    db.bulk_insert('votes', ['roll_id', 'name_id', 'vote'], votes)
+    return len(votes)
+
+
+def time_script(name, script_args=[]):
+    sys.argv = [name] + script_args
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        runpy.run_path(str(REPO_FOLDER / name), run_name='__main__')
+    return time.perf_counter() - start
+
+
+def time_point_queries(repeats):
+    times = {}
+    with contextlib.redirect_stdout(io.StringIO()), PALegislatureDB() as db:
+        for label, (query, param_query) in POINT_QUERIES.items():
+            params = [tuple(row) for row in db.execute(param_query)]
+            params = random.Random(0).choices(params, k=repeats)
+            start = time.perf_counter()
+            for param in params:
+                db.execute(query, param).fetchall()
+            times[label] = time.perf_counter() - start
+    return times
+
+
+def run_variant(folder, with_layout, generated_db, repeats):
+    """Time the migration to this layout, the point queries, dump.py and match_names.py"""
+    folder.mkdir()
+    write_yaml(folder, with_layout)
+    shutil.copy(generated_db, folder / 'pa_legislature.db')
+    os.chdir(folder)
+
+    results = {}
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), PALegislatureDB():
+        pass
+    results['open/migrate'] = time.perf_counter() - start
+    results.update(time_point_queries(repeats))
+    results['dump.py -f'] = time_script('dump.py', ['-f'])
+    results['match_names.py -w'] = time_script('match_names.py', ['-w'])
+    results['file size (MB)'] = (folder / 'pa_legislature.db').stat().st_size / 1024 / 1024
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the database with and without the unique_keys, '
+                                                 'without_rowid and indexes from pa_legislature.yaml')
+    parser.add_argument('-y', '--years', type=int, default=4)
+    parser.add_argument('-r', '--rolls', type=int, default=200, help='Roll calls per year and chamber')
+    parser.add_argument('-d', '--days', type=int, default=40, help='Session days per year and chamber')
+    parser.add_argument('-n', '--repeats', type=int, default=1000, help='Number of times to run each point query')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_folder:
+        temp_folder = pathlib.Path(temp_folder)
+        generate_folder = temp_folder / 'generate'
+        generate_folder.mkdir()
+        write_yaml(generate_folder, with_layout=False)
+        os.chdir(generate_folder)
+        click.secho('Generating data...', fg='bright_black')
+        with contextlib.redirect_stdout(io.StringIO()), PALegislatureDB() as db:
+            n_votes = populate(db, args.years, args.rolls, args.days)
+
+        before = run_variant(temp_folder / 'before', False, generate_folder / 'pa_legislature.db', args.repeats)
+        after = run_variant(temp_folder / 'after', True, generate_folder / 'pa_legislature.db', args.repeats)
+        os.chdir(REPO_FOLDER)
+
+    click.secho(f'{args.years} years, {args.rolls} rolls/year/chamber, {n_votes} votes', fg='bright_white')
+    click.secho(f'{"":28s} {"before":>10s} {"after":>10s} {"speedup":>8s}', fg='bright_white')
+    for label in before:
+        speedup = before[label] / after[label] if after[label] else 0.0
+        click.secho(f'{label:28s} {before[label]:10.3f} {after[label]:10.3f} {speedup:7.1f}x')
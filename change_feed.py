@@ -0,0 +1,139 @@
+#!/usr/bin/python3
+"""Append-only feed of the roll calls that each export added or changed (see dump.py -c).
+
+Each line of the feed is the JSON record of one roll call, with its votes by member_id and a seq one higher than the
+line before it. The lines are split into segments of SEGMENT_RECORDS, each named after the seq of its first line, so
+a consumer that has already seen up to some seq only has to read the segments after it (see read_changes).
+
+A roll gets a new record whenever its record (without the seq) differs from the last one written for it: when it is
+first exported, when it is recrawled with different votes, or when one of its voters is matched to a member. The hashes
+of the last records are kept in STATE_PATH. Rolls that are removed do not get a record.
+"""
+import argparse
+import click
+import datetime
+import hashlib
+import json
+import pathlib
+
+FEED_FOLDER = pathlib.Path('vote_feed')
+STATE_PATH = FEED_FOLDER / 'state.json'
+SEGMENT_RECORDS = 10000
+
+
+def get_slice_name(year, chamber):
+    return f'{year}/{chamber.name.title()}'
+
+
+def get_roll_record(year, chamber, roll, date, votes):
+    stamp = roll['stamp'] if isinstance(roll['stamp'], datetime.datetime) else None
+    return {
+        'roll_id': roll['id'],
+        'year': year,
+        'chamber': chamber.name.title(),
+        'number': roll['number'],
+        'name': roll['name'],
+        'date': str(date),
+        'stamp': str(stamp) if stamp else None,
+        'votes': {str(member_id): vote.to_letter() for member_id, vote in sorted(votes.items())},
+    }
+
+
+def get_hash(record):
+    """The keys are sorted, so that the hash does not depend on the order that the votes were read in"""
+    return hashlib.sha1(json.dumps(record, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def collect_changes(roll_votes, year, chamber, day_dates, old_hashes, changes, hashes):
+    """Pass the (roll, votes) pairs through, adding the record of each roll that changed since old_hashes to changes.
+
+    The hash of every roll's record goes in hashes, by roll_id (as a string, like the JSON keys)"""
+    for roll, votes in roll_votes:
+        record = get_roll_record(year, chamber, roll, day_dates[roll['day_id']], votes)
+        roll_hash = get_hash(record)
+        hashes[str(roll['id'])] = roll_hash
+        if old_hashes.get(str(roll['id'])) != roll_hash:
+            changes.append(record)
+        yield roll, votes
+
+
+def load_state():
+    if STATE_PATH.exists():
+        return json.load(open(STATE_PATH))
+    return {'versions': {}, 'rolls': {}}
+
+
+def save_state(state):
+    """Replace the state file in one step, so that it always matches a complete feed"""
+    FEED_FOLDER.mkdir(exist_ok=True)
+    temp_path = STATE_PATH.with_suffix('.tmp')
+    with open(temp_path, 'w') as f:
+        json.dump(state, f)
+    temp_path.replace(STATE_PATH)
+
+
+def get_segment_path(seq):
+    first = (seq - 1) // SEGMENT_RECORDS * SEGMENT_RECORDS + 1
+    return FEED_FOLDER / f'{first:09d}.ndjson'
+
+
+def get_last_seq():
+    """Return the seq of the last record in the feed (0 if it is empty).
+
+    This comes from the feed itself rather than the state, so that the seq keeps increasing even if the state was not
+    saved after the last append"""
+    segments = sorted(FEED_FOLDER.glob('*.ndjson'))
+    if not segments:
+        return 0
+    last_line = None
+    with open(segments[-1]) as f:
+        for line in f:
+            last_line = line
+    if last_line is None:
+        return int(segments[-1].stem) - 1
+    return json.loads(last_line)['seq']
+
+
+def append_changes(records, last_seq):
+    """Append the records to the feed, numbering them after last_seq. Returns the new last seq"""
+    FEED_FOLDER.mkdir(exist_ok=True)
+    f = None
+    for record in records:
+        last_seq += 1
+        path = get_segment_path(last_seq)
+        if f is None or f.name != str(path):
+            if f is not None:
+                f.close()
+            f = open(path, 'a')
+        f.write(json.dumps({'seq': last_seq, **record}) + '\n')
+    if f is not None:
+        f.close()
+    return last_seq
+
+
+def read_changes(after_seq=0):
+    """Yield the records with a seq after after_seq, without reading the segments that only have older ones"""
+    for path in sorted(FEED_FOLDER.glob('*.ndjson')):
+        if int(path.stem) + SEGMENT_RECORDS - 1 <= after_seq:
+            continue
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                if record['seq'] > after_seq:
+                    yield record
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Summarize the records in the change feed after a given seq')
+    parser.add_argument('after_seq', type=int, nargs='?', default=0)
+    args = parser.parse_args()
+
+    n = 0
+    rolls = set()
+    last_seq = args.after_seq
+    for record in read_changes(args.after_seq):
+        n += 1
+        rolls.add(record['roll_id'])
+        last_seq = record['seq']
+    click.secho(f'{n} records for {len(rolls)} rolls after seq {args.after_seq}. The last seq is {last_seq}',
+                fg='bright_white')
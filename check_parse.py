@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+import argparse
+import bs4
+import click
+
+import crawl
+from page_cache import PageCache, CACHE_FOLDER
+
+
+def parse_day(soup):
+    link = soup.find('a', string='Floor Roll Call Votes')
+    return link and link['href']
+
+
+# The parse method and regions of each kind of cached page, by a piece of its url
+PAGE_KINDS = {
+    'sessionPriorDays.cfm': ('day', parse_day, crawl.DAY_REGIONS),
+    'rc_view_action2.cfm': ('roll', crawl.parse_roll, crawl.ROLL_REGIONS),
+}
+
+
+def parse_both_ways(contents, parse_method, regions, parser):
+    """Return what parse_method gets from the whole page and from only the regions (or the error it raised)"""
+    results = []
+    for parse_only in [None, regions]:
+        try:
+            results.append(parse_method(bs4.BeautifulSoup(contents, parser, parse_only=parse_only)))
+        except Exception as e:
+            results.append(repr(e))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that parsing only the regions of the cached pages that '
+                                                 'crawl.py uses gives the same results as parsing the whole pages')
+    parser.add_argument('--cache-folder', default=CACHE_FOLDER)
+    parser.add_argument('--parser', choices=['html.parser', 'lxml'], default='html.parser')
+    args = parser.parse_args()
+
+    cache = PageCache(args.cache_folder, max_bytes=None)
+    pages = []
+    for (url,) in cache.index.execute('SELECT url FROM pages ORDER BY url'):
+        for piece, (kind, parse_method, regions) in PAGE_KINDS.items():
+            if piece in url:
+                pages.append((url, kind, parse_method, regions))
+
+    # The floor vote pages are found through the day pages
+    floor_urls = set()
+    for url, kind, parse_method, regions in list(pages):
+        contents = cache.read_url(url) if kind == 'day' else None
+        if contents is not None:
+            href = parse_day(bs4.BeautifulSoup(contents, args.parser))
+            if href:
+                floor_urls.add('https://www.legis.state.pa.us' + href)
+    for url in sorted(floor_urls):
+        if cache.read_url(url) is not None:
+            pages.append((url, 'floor', crawl.parse_floor_votes, crawl.FLOOR_VOTE_REGIONS))
+
+    checked = 0
+    different = 0
+    for url, kind, parse_method, regions in pages:
+        contents = cache.read_url(url)
+        if contents is None:
+            continue
+        whole, strained = parse_both_ways(contents, parse_method, regions, args.parser)
+        checked += 1
+        if whole != strained:
+            different += 1
+            click.secho(f'{kind:5s} {url}', fg='red')
+            click.secho(f'\twhole page: {whole}', fg='bright_black')
+            click.secho(f'\tregions:    {strained}', fg='bright_black')
+
+    click.secho(f'{checked} pages checked, {different} different', fg='yellow' if different else 'bright_white')
@@ -2,24 +2,28 @@
 import argparse
 import bs4
 import click
+import collections
+import concurrent.futures
 import datetime
 import dateutil.parser
 from nameparser import HumanName
 from nameparser.config import CONSTANTS
+import os
 import pathlib
 import re
-import requests
+import socket
 import urllib.parse
 import yaml
 
 from pa_legislature import PALegislatureDB, Chamber, Vote
 from names import dict_to_name
+from fetch import Fetcher
+from metrics import CrawlMetrics
+from replay import ReplayArchive
+from page_cache import PageCache, DEFAULT_MAX_BYTES
+from scheduler import plan_refreshes, get_signature, record_refresh
+import work_queue
 
-CACHE_FOLDER = pathlib.Path('.cached_html')
-USER_AGENT = {
-    'User-Agent': 'PALegislature Bot',
-    'From': 'davidvlu@gmail.com'
-}
 
 # Customize NameParser
 CONSTANTS.titles.remove('pope')
@@ -31,69 +35,115 @@ SENATE_BIO_TEMPLATE = 'https://www.legis.state.pa.us/cfdocs/legis/BiosHistory/Me
 HOUSE_BIO_TEMPLATE = 'https://archives.house.state.pa.us/people/member-biography?ID={number}'
 
 
-def get_page(url, name, use_cached=False):
-    CACHE_FOLDER.mkdir(exist_ok=True)
-    cache_path = CACHE_FOLDER / (name + '.html')
-    if use_cached and cache_path.exists():
-        contents = open(cache_path).read()
-    else:
-        req = requests.get(url, headers=USER_AGENT)
-        contents = req.text
+METRICS = CrawlMetrics()
+FETCHER = Fetcher(metrics=METRICS)
+PARSER = 'html.parser'
+WORKERS = 1
+
+# The metrics stage of each kind of task
+KIND_STAGES = {
+    'session': 'sessions',
+    'day': 'days',
+    'roll': 'rolls',
+    'member_list': 'member_lists',
+    'bio': 'bios',
+}
+
+
+def has_class(*names):
+    """Return a class_ filter for a SoupStrainer that matches any element with one of the names among its classes.
+
+    Unlike find(), a strainer given a class name (or list of them) only matches elements with that exact class
+    attribute, so it would drop an element with an extra class"""
+    def check(value):
+        if not value:
+            return False
+        classes = value.split() if isinstance(value, str) else value
+        return any(name in classes for name in names)
+    return check
+
+
+# Only the regions of the page that the parsing actually uses
+DAY_REGIONS = bs4.SoupStrainer('a')
+FLOOR_VOTE_REGIONS = bs4.SoupStrainer('table', class_=has_class('DataTable'))
+ROLL_REGIONS = bs4.SoupStrainer('div', class_=has_class('RollCalls-ListContainer', 'Column-OneFourth'))
 
-        if use_cached:
-            with open(cache_path, 'w') as f:
-                f.write(contents)
 
-    return bs4.BeautifulSoup(contents, 'html.parser')
+def get_page(url, parse_only=None):
+    contents = FETCHER.get_text(url)
+    with METRICS.timer('parse_seconds'):
+        return bs4.BeautifulSoup(contents, PARSER, parse_only=parse_only)
 
 
 def chamber_arg(chamber):
     return chamber.name[0]
 
 
-def update_session_years(db, chamber, year=None, index=None):
+def write_item(db, write_method, item, fetched):
+    """Call write_method and commit, recording its time and counting one item for the current metrics stage.
+
+    Committing each item lets other processes read the progress, and write between the items"""
+    with METRICS.timer('write_seconds'):
+        result = write_method(db, item, fetched)
+        db.write()
+    METRICS.count('items')
+    return result
+
+
+def crawl_concurrently(db, items, fetch_method, write_method, workers=1):
+    """Run fetch_method on each item in a thread pool, but call write_method (with the db) from this thread only.
+
+    Results are written in the same order as the items, and only a bounded number of fetches are in flight.
+    The fetches are recorded in the current metrics stage of this thread."""
+    if workers <= 1:
+        for item in items:
+            write_item(db, write_method, item, fetch_method(item))
+        return
+
+    stage = METRICS.current_stage()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for item in items:
+            pending.append((item, executor.submit(METRICS.call_in_stage, stage, fetch_method, item)))
+            if len(pending) >= 2 * workers:
+                item, future = pending.popleft()
+                write_item(db, write_method, item, future.result())
+        while pending:
+            item, future = pending.popleft()
+            write_item(db, write_method, item, future.result())
+
+
+def get_session_url(chamber, year=None, index=None):
     url = 'https://www.legis.state.pa.us/SessionDays.cfm?'
     params = {'Chamber': chamber_arg(chamber)}
     if year is not None:
         params['SessionYear'] = year
     if index is not None:
         params['SessionInd'] = index
+    return url + urllib.parse.urlencode(params)
 
-    full_url = url + urllib.parse.urlencode(params)
-    if year is None:
-        click.secho(f'Updating {chamber} Session List', fg='blue', nl=False)
-    else:
-        click.secho(f'Updating {chamber} Session: {year}/{index}', fg='blue', nl=False)
-
-    click.secho(f' ({full_url})', fg='bright_black')
-
-    soup = get_page(full_url, 'session')
 
-    # Update Sessions
+def parse_session_page(soup, chamber, year, index):
+    # Find Sessions
+    sessions = []
     dropdown = soup.find('select', {'id': 'SessID'})
     for option in dropdown.find_all('option'):
         code = option['value']
         row = {'chamber': chamber, 'year': int(code[:4]), 'session_index': int(code[4]), 'name': option.text}
-        db.update('sessions', row, ['chamber', 'year', 'session_index'])
+        sessions.append(row)
         if option.get('selected') is not None:
             if year is None:
                 year = row['year']
             if index is None:
                 index = row['session_index']
 
-    # Find Proper Session for this page
-    session_id = db.lookup('id', 'sessions',
-                           f'WHERE chamber={chamber.value} AND year={year} and session_index={index}')
-
-    # Update Days
-    found = 0
+    # Find Days (or None if the page does not list them yet)
+    dates = []
     for column in soup.find_all('div', class_='Column-OneHalf'):
         header = column.find('h3')
         if not header:
-            if found == 0:
-                if datetime.datetime.now().year >= year:
-                    click.secho('Cannot find h3 on session page. Skipping for now...', fg='yellow')
-                return
+            if not dates:
+                return sessions, year, index, None
             continue
 
         if 'Scheduled' in header.text:
@@ -107,19 +157,59 @@ def update_session_years(db, chamber, year=None, index=None):
                     day_s = day_s.split('\xa0')[0]
                 day = int(day_s)
 
-                date = datetime.date(year, month, day)
-                row = {'session_id': session_id, 'date': date}
-                db.update('session_days', row, row)
-                found += 1
-    click.secho(f'\t{found:3d} days found', fg='blue')
+                dates.append(datetime.date(year, month, day))
+    return sessions, year, index, dates
+
+
+def fetch_session(session_key):
+    """Download and parse a session page. session_key is (chamber, year, index), where year/index may be None"""
+    full_url = get_session_url(*session_key)
+    return full_url, parse_session_page(get_page(full_url), *session_key)
+
+
+def write_session(db, session_key, fetched):
+    """Returns the id of the session that the page was for"""
+    chamber, year, index = session_key
+    full_url, (sessions, year, index, dates) = fetched
+    if session_key[1] is None:
+        click.secho(f'Updating {chamber} Session List', fg='blue', nl=False)
+    else:
+        click.secho(f'Updating {chamber} Session: {year}/{index}', fg='blue', nl=False)
+
+    click.secho(f' ({full_url})', fg='bright_black')
+
+    # Update Sessions
+    for row in sessions:
+        db.update('sessions', row, ['chamber', 'year', 'session_index'])
+
+    # Find Proper Session for this page
+    session_id = db.lookup('id', 'sessions', {'chamber': chamber, 'year': year, 'session_index': index})
+
+    # Update Days
+    if dates is None:
+        if datetime.datetime.now().year >= year:
+            click.secho('Cannot find h3 on session page. Skipping for now...', fg='yellow')
+        return session_id
+
+    for date in dates:
+        row = {'session_id': session_id, 'date': date}
+        db.update('session_days', row, row)
+    click.secho(f'\t{len(dates):3d} days found', fg='blue')
     db.update('sessions', {'id': session_id, 'last_crawl': datetime.datetime.now()})
+    return session_id
 
 
-def update_day(db, day_d):
+def update_session_years(db, chamber, year=None, index=None):
+    session_key = chamber, year, index
+    return write_item(db, write_session, session_key, fetch_session(session_key))
+
+
+def get_day_request(db, day_d):
+    """Return the chamber and the url of the day page"""
     url = 'https://www.legis.state.pa.us/cfdocs/legis/home/sessionPriorDays.cfm?'
 
     session_id = day_d['session_id']
-    session = db.query_one(f'SELECT chamber, session_index FROM sessions WHERE id={session_id}')
+    session = db.select_one('sessions', ['chamber', 'session_index'], {'id': session_id})
     if not session:
         raise RuntimeError(f'Cannot find session {session_id}')
 
@@ -129,65 +219,80 @@ def update_day(db, day_d):
     params['Chamber'] = chamber_arg(chamber)
     params['SessionDate'] = day_d['date'].strftime('%m/%d/%Y')
 
-    full_url = url + urllib.parse.urlencode(params)
+    return chamber, url + urllib.parse.urlencode(params)
 
-    click.secho(f'Updating {chamber} on {params["SessionDate"]}', fg='cyan', nl=False)
-    click.secho(f' ({full_url})', fg='bright_black')
 
-    soup = get_page(full_url, 'day')
+def parse_floor_votes(soup):
+    rolls = []
+    table = soup.find('table', class_='DataTable')
+    for row in table.find('tbody').find_all('tr'):
+        links = row.find_all('a')
+        assert links[0]['id'].startswith('RCLink')
+        roll_url = urllib.parse.urlparse(links[0]['href'])
+        roll_query = urllib.parse.parse_qs(roll_url.query)
+        query = {k: v[0] if len(v) == 1 else v for k, v in roll_query.items()}
+
+        rolls.append({'number': int(query['rc_nbr']),
+                      'session_year': int(query['sess_yr']),
+                      'session_index': int(query['sess_ind']),
+                      'chamber': Chamber.from_letter(query['rc_body']),
+                      'name': links[0].text.strip()})
+    return rolls
+
+
+def fetch_day(day_request):
+    """Download and parse a day page and its floor votes. The rolls are None if there are no votes"""
+    chamber, full_url = day_request
+    soup = get_page(full_url, DAY_REGIONS)
 
     link = soup.find('a', string='Floor Roll Call Votes')
     if not link:
+        return chamber, full_url, None, None
+    floor_url = 'https://www.legis.state.pa.us' + link['href']
+
+    return chamber, full_url, floor_url, parse_floor_votes(get_page(floor_url, FLOOR_VOTE_REGIONS))
+
+
+def write_day(db, day_d, fetched):
+    chamber, full_url, floor_url, rolls = fetched
+
+    click.secho(f'Updating {chamber} on {day_d["date"].strftime("%m/%d/%Y")}', fg='cyan', nl=False)
+    click.secho(f' ({full_url})', fg='bright_black')
+
+    if rolls is None:
         click.secho('\tNo votes found', fg='cyan')
         db.update('session_days', {'id': day_d['id'], 'last_crawl': datetime.datetime.now()})
         return
-    floor_url = 'https://www.legis.state.pa.us' + link['href']
 
     click.secho('\tGetting floor votes', fg='cyan', nl=False)
     click.secho(f' ({floor_url})', fg='bright_black')
 
-    soup = get_page(floor_url, 'votes')
-
-    table = soup.find('table', class_='DataTable')
-    found = 0
-    for row in table.find('tbody').find_all('tr'):
-        links = row.find_all('a')
-        assert links[0]['id'].startswith('RCLink')
-        roll_url = urllib.parse.urlparse(links[0]['href'])
-        roll_query = urllib.parse.parse_qs(roll_url.query)
-        query = {k: v[0] if len(v) == 1 else v for k, v in roll_query.items()}
-
-        roll_d = {'day_id': day_d['id'],
-                  'number': int(query['rc_nbr']),
-                  'session_year': int(query['sess_yr']),
-                  'session_index': int(query['sess_ind']),
-                  'chamber': Chamber.from_letter(query['rc_body']),
-                  'name': links[0].text.strip()}
+    for roll_d in rolls:
+        roll_d = dict(roll_d, day_id=day_d['id'])
         db.update('roll_calls', roll_d, roll_d)
-        found += 1
 
-    click.secho(f'\t{found} rolls found', fg='cyan')
+    click.secho(f'\t{len(rolls)} rolls found', fg='cyan')
     db.update('session_days', {'id': day_d['id'], 'last_crawl': datetime.datetime.now()})
 
 
-def update_roll(db, roll):
+def update_day(db, day_d):
+    write_item(db, write_day, day_d, fetch_day(get_day_request(db, day_d)))
+
+
+def get_roll_url(roll):
     url = 'https://www.legis.state.pa.us/cfdocs/legis/RC/PUBLIC/rc_view_action2.cfm?'
 
-    chamber = roll['chamber']
     params = {}
     params['sess_yr'] = roll['session_year']
     params['sess_ind'] = roll['session_index']
-    params['rc_body'] = chamber_arg(chamber)
+    params['rc_body'] = chamber_arg(roll['chamber'])
     params['rc_nbr'] = roll['number']
-    session_id = db.lookup('session_id', 'session_days', {'id': roll['day_id']})
-
-    full_url = url + urllib.parse.urlencode(params)
-    click.secho(f'Getting {chamber} vote #{roll["number"]}', fg='cyan', nl=False)
-    click.secho(f' ({full_url})', fg='bright_black')
+    return url + urllib.parse.urlencode(params)
 
-    soup = get_page(full_url, 'roll')
 
+def parse_roll(soup):
     # Get the votes
+    votes = []
     container = soup.find('div', class_='RollCalls-ListContainer')
     for div in container.find_all('div'):
         if div['class'][0].startswith('Column'):
@@ -196,14 +301,7 @@ def update_roll(db, roll):
         kids = list(div.children)
         vote = kids[1].text
         name = kids[2].strip()
-
-        vote_d = {
-            'session_id': session_id,
-            'roll_id': roll['id'],
-            'name': name,
-            'vote': Vote.from_letter(vote),
-        }
-        db.update('votes', vote_d, vote_d)
+        votes.append((name, Vote.from_letter(vote)))
 
     # Get the time stamp
     side_div = soup.find('div', class_='Column-OneFourth')
@@ -214,12 +312,35 @@ def update_roll(db, roll):
         time_s = info_sections[1].text
         stamp = dateutil.parser.parse(f'{date_s} {time_s}')
     else:
-        click.secho('\tCould not find time stamp', fg='yellow')
         stamp = None
 
+    return votes, stamp
+
+
+def fetch_roll(roll):
+    """Download and parse a roll page. Safe to call from worker threads, since it does not touch the db"""
+    full_url = get_roll_url(roll)
+    return full_url, parse_roll(get_page(full_url, ROLL_REGIONS))
+
+
+def write_roll(db, roll, fetched):
+    full_url, (votes, stamp) = fetched
+    click.secho(f'Getting {roll["chamber"]} vote #{roll["number"]}', fg='cyan', nl=False)
+    click.secho(f' ({full_url})', fg='bright_black')
+
+    session_id = db.lookup('session_id', 'session_days', {'id': roll['day_id']})
+    db.update_votes(session_id, roll['id'], votes)
+
+    if stamp is None:
+        click.secho('\tCould not find time stamp', fg='yellow')
+
     db.update('roll_calls', {'id': roll['id'], 'stamp': stamp, 'last_crawl': datetime.datetime.now()})
 
 
+def update_roll(db, roll):
+    write_item(db, write_roll, roll, fetch_roll(roll))
+
+
 ALL_CAPS = re.compile(r'^[^a-z]+$')
 TWO_CAPS = re.compile(r'[A-Z]{2}')
 
@@ -299,13 +420,13 @@ def assert_names_equal(name_dict1, name_dict2, fatal=False):
         return False
 
 
-def get_member_list(db, url, name, wrapper_spec, chamber):
-    click.secho(f'Updating {name} List', fg='bright_yellow', nl=False)
-    click.secho(f' ({url})', fg='bright_black')
-    soup = get_page(url, name)
+def fetch_historical_list(url, wrapper_spec, chamber):
+    """Download and parse a list of historical members, returning (member row, key) pairs"""
+    soup = get_page(url)
 
     content = soup.find('div', wrapper_spec)
 
+    members = []
     for link in content.find_all('a'):
         bio_url = urllib.parse.urlparse(link['href'])
         bio_query = urllib.parse.parse_qs(bio_url.query)
@@ -317,17 +438,27 @@ def get_member_list(db, url, name, wrapper_spec, chamber):
         member = {key: archive_id}
 
         member.update(get_name_dict(full_name))
+        members.append((member, key))
+    return members
+
+
+def write_historical_list(db, url, name, fetched):
+    click.secho(f'Updating {name} List', fg='bright_yellow', nl=False)
+    click.secho(f' ({url})', fg='bright_black')
+    for member, key in fetched:
         db.update('members', member, key)
 
 
-def update_senator_list(db):
+def get_senator_list_work():
     url = 'https://www.legis.state.pa.us/cfdocs/legis/BiosHistory/ViewAll.cfm?body=S'
-    get_member_list(db, url, 'Senator Member', {'class': 'Column-Full'}, Chamber.SENATE)
+    return fetch_historical_list, [url, {'class': 'Column-Full'}, Chamber.SENATE], \
+        write_historical_list, [url, 'Senator Member']
 
 
-def update_representative_list(db, letter):
+def get_representative_list_work(letter):
     url = 'https://archives.house.state.pa.us/people/view-all?letter=' + letter
-    get_member_list(db, url, f'House Member {letter}', {'id': 'portfolioPaginationWrapper'}, Chamber.HOUSE)
+    return fetch_historical_list, [url, {'id': 'portfolioPaginationWrapper'}, Chamber.HOUSE], \
+        write_historical_list, [url, f'House Member {letter}']
 
 
 def parse_year_range(s):
@@ -342,30 +473,55 @@ def parse_year_range(s):
     return year_range
 
 
-RESOLUTIONS = yaml.safe_load(open('resolutions.yaml'))
+LEGACY_RESOLUTIONS = pathlib.Path('resolutions.yaml')
 
 
-def get_resolved_url(url):
-    if url in RESOLUTIONS:
-        return RESOLUTIONS[url]
+def import_legacy_resolutions(db):
+    """Copy the resolutions from the old yaml file into the resolutions table (once)"""
+    if not LEGACY_RESOLUTIONS.exists() or db.count('resolutions') > 0:
+        return
+    legacy = yaml.safe_load(open(LEGACY_RESOLUTIONS)) or {}
+    db.bulk_insert('resolutions', ['url', 'resolved'], list(legacy.items()))
+    click.secho(f'Imported {len(legacy)} resolutions from {LEGACY_RESOLUTIONS}', fg='bright_black')
+
+
+def follow_redirects(url):
+    """Return where the url eventually redirects to, or None if it does not. Does not touch the db"""
     resolved = url
     while True:
-        r = requests.head(resolved, headers=USER_AGENT)
+        r = FETCHER.head(resolved)
 
         if r.status_code not in [301, 302] or 'Location' not in r.headers:
             break
         resolved = urllib.parse.urljoin(resolved, r.headers['Location'])
 
-    ret = None if resolved == url else resolved
-    RESOLUTIONS[url] = ret
-    yaml.safe_dump(RESOLUTIONS, open('resolutions.yaml', 'w'))
-
     if resolved == url:
         return
     else:
         return resolved
 
 
+def store_resolution(db, url, resolved):
+    db.execute('INSERT OR REPLACE INTO resolutions (url, resolved) VALUES(?, ?)', [url, resolved])
+
+
+def resolve_urls(db, urls, workers=1):
+    """Store the resolution of each of the urls, following the redirects of any new ones concurrently"""
+    new_urls = [url for url in dict.fromkeys(urls) if db.count('resolutions', {'url': url}) == 0]
+    with METRICS.stage('resolutions'):
+        crawl_concurrently(db, new_urls, follow_redirects, store_resolution, workers)
+
+
+def get_resolved_url(db, url):
+    known = db.select_one('resolutions', 'resolved', {'url': url})
+    if known:
+        return known['resolved']
+    resolved = follow_redirects(url)
+    store_resolution(db, url, resolved)
+    return resolved
+
+
+CURRENT_ROLL_URL = 'https://www.legis.state.pa.us/cfdocs/legis/home/member_information/'
 PARTY_PATTERN = re.compile(r'\((.)\)')
 DISTRICT_PATTERN = re.compile(r'District (\d+)')
 PARTY_CODES = {
@@ -375,58 +531,112 @@ PARTY_CODES = {
 }
 
 
-def update_current_roll(db, chamber, year=None):
-    base_url = 'https://www.legis.state.pa.us/cfdocs/legis/home/member_information/'
+def get_current_roll_url(chamber, year=None):
     params = {'body': chamber_arg(chamber)}
     if year is not None:
         params['SessYear'] = year
+    return CURRENT_ROLL_URL + 'mbrList.cfm?' + urllib.parse.urlencode(params)
 
-    full_url = base_url + 'mbrList.cfm?' + urllib.parse.urlencode(params)
-    if year is None:
-        click.secho(f'Updating {chamber} Member List', fg='bright_yellow', nl=False)
-    else:
-        click.secho(f'Updating {year} {chamber} Member List', fg='bright_yellow', nl=False)
-    click.secho(f' ({full_url})', fg='bright_black')
 
-    soup = get_page(full_url, 'CurrentRoll')
+def parse_member_info(bio):
+    """Return the party and district from the text of a member's MemberInfoList-MemberBio div"""
+    party = None
+    district = None
 
-    # Update Session Years
+    for child in bio.children:
+        if isinstance(child, bs4.element.Tag):
+            continue
+        text = child.text.strip()
+        if not text:
+            continue
+
+        m1 = PARTY_PATTERN.match(text)
+        m2 = DISTRICT_PATTERN.match(text)
+        if m1:
+            if party:
+                raise RuntimeError('Already have party')
+            party_s = m1.group(1)
+            if party_s not in PARTY_CODES:
+                raise RuntimeError(f'Unknown party code {party_s}')
+            party = PARTY_CODES[party_s]
+        elif m2:
+            if district is not None:
+                raise RuntimeError('Already have district')
+            district = int(m2.group(1))
+        else:
+            raise RuntimeError('Cannot parse group member info: ' + repr(text))
+
+    if not party:
+        raise RuntimeError('Cannot find party')
+    if district is None:
+        raise RuntimeError('Cannot find district')
+    return party, district
+
+
+def fetch_current_roll(chamber, year=None):
+    """Download and parse a member list for one session.
+
+    Returns the member_crawl names of all the session years in the dropdown, the years of this session (or None),
+    and the name dict, current id, bio url, party and district of each member."""
+    soup = get_page(get_current_roll_url(chamber, year))
+
+    # Find Session Years
     dropdown = soup.find('select', {'id': 'SessYear'})
+    update_names = []
     year_range = None
     for option in dropdown.find_all('option'):
-        update_name = option['value'] + ' ' + chamber.name
-        db.update('member_crawl', {'name': update_name}, ['name'])
+        update_names.append(option['value'] + ' ' + chamber.name)
 
         if option.get('selected') is not None:
             name = option.text.replace('\xa0', ' ').strip()
             year_range = parse_year_range(name)
 
-    if not year_range:
-        click.secho('Could not find year range from option box!', fg='red')
-        exit(-1)
-
-    found = 0
+    members = []
     for info in soup.find_all('div', class_='MemberInfoList-MemberWrapper'):
         bio = info.find('div', class_='MemberInfoList-MemberBio')
         link = bio.find('a')
-        member_name = link.text.strip()
-        name_dict = get_name_dict(member_name)
-        bio_url = urllib.parse.urlparse(link['href'])
-        bio_query = urllib.parse.parse_qs(bio_url.query)
-
+        name_dict = get_name_dict(link.text.strip())
+        bio_query = urllib.parse.parse_qs(urllib.parse.urlparse(link['href']).query)
         current_id = int(bio_query['id'][0])
+        party, district = parse_member_info(bio)
+        members.append((name_dict, current_id, CURRENT_ROLL_URL + link['href'], party, district))
+
+    return update_names, year_range, members
 
-        resolved_url = get_resolved_url(base_url + link['href'])
+
+def write_current_roll(db, chamber, year, fetched):
+    update_names, year_range, members = fetched
+    full_url = get_current_roll_url(chamber, year)
+    if year is None:
+        click.secho(f'Updating {chamber} Member List', fg='bright_yellow', nl=False)
+    else:
+        click.secho(f'Updating {year} {chamber} Member List', fg='bright_yellow', nl=False)
+    click.secho(f' ({full_url})', fg='bright_black')
+
+    # Update Session Years
+    for update_name in update_names:
+        db.update('member_crawl', {'name': update_name}, ['name'])
+
+    if not year_range:
+        click.secho('Could not find year range from option box!', fg='red')
+        exit(-1)
+
+    resolve_urls(db, [member[2] for member in members], WORKERS)
+
+    found = 0
+    services = []
+    for name_dict, current_id, bio_url, party, district in members:
+        resolved_url = get_resolved_url(db, bio_url)
         if resolved_url and 'archives' in resolved_url:
             if '?ID=' not in resolved_url and 'search-results' in resolved_url:
                 resolved_url += '&fnme=' + name_dict['first']
-                resolved_url = get_resolved_url(resolved_url)
+                resolved_url = get_resolved_url(db, resolved_url)
                 click.secho('\tBonus search', fg='bright_cyan')
             resolved_bio_url = urllib.parse.urlparse(resolved_url)
             resolved_bio_query = urllib.parse.parse_qs(resolved_bio_url.query)
             if 'ID' not in resolved_bio_query:
                 print(name_dict)
-                print(base_url + link['href'])
+                print(bio_url)
                 print(resolved_url)
             archive_id = int(resolved_bio_query['ID'][0])
             if archive_id == current_id:
@@ -461,51 +671,25 @@ def update_current_roll(db, chamber, year=None):
             member_id = db.insert('members', row)
         else:
             click.secho('Multiple matches for found member', fg='red')
-            click.secho('\t{base_url}{link["href"]}', fg='bright_black')
-            click.secho('\t{resolved_url}', fg='bright_black')
+            click.secho(f'\t{bio_url}', fg='bright_black')
+            click.secho(f'\t{resolved_url}', fg='bright_black')
             for match in existing_matches:
                 click.secho(str(match), fg='cyan')
             exit(-1)
 
-        party = None
-        district = None
-
-        for child in bio.children:
-            if isinstance(child, bs4.element.Tag):
-                continue
-            text = child.text.strip()
-            if not text:
-                continue
-
-            m1 = PARTY_PATTERN.match(text)
-            m2 = DISTRICT_PATTERN.match(text)
-            if m1:
-                if party:
-                    raise RuntimeError('Already have party')
-                party_s = m1.group(1)
-                if party_s not in PARTY_CODES:
-                    raise RuntimeError(f'Unknown party code {party_s}')
-                party = PARTY_CODES[party_s]
-            elif m2:
-                if district is not None:
-                    raise RuntimeError('Already have district')
-                district = int(m2.group(1))
-            else:
-                raise RuntimeError('Cannot parse group member info: ' + repr(text))
-
-        if not party:
-            raise RuntimeError('Cannot find party')
-        if district is None:
-            raise RuntimeError('Cannot find district')
-
         for year in year_range:
-            row = {'member_id': member_id, 'year': year, 'chamber': chamber, 'district': district, 'party': party}
-            db.update('service', row, ['member_id', 'year', 'chamber'])
+            services.append({'member_id': member_id, 'year': year, 'chamber': chamber, 'district': district,
+                             'party': party})
 
         found += 1
+    db.update_service(services)
     click.secho(f'\t{found} members found', fg='bright_yellow')
 
 
+def get_current_roll_work(chamber, year=None):
+    return fetch_current_roll, [chamber, year], write_current_roll, [chamber, year]
+
+
 def condense(year_list):
     start = None
     end = None
@@ -530,31 +714,20 @@ def condense(year_list):
     return ', '.join(bits)
 
 
-def update_member(db, member):
-    mid = member['id']
-
+def get_bio_request(member):
+    """Return the chamber, archive number and url of a member's biography, or None if there is no archive id"""
     if member['house_archive_id'] is not None:
-        chamber = Chamber.HOUSE
         number = member['house_archive_id']
-        url = HOUSE_BIO_TEMPLATE.format(number=number)
+        return Chamber.HOUSE, number, HOUSE_BIO_TEMPLATE.format(number=number)
     elif member['senate_archive_id']:
-        chamber = Chamber.SENATE
         number = member['senate_archive_id']
-        url = SENATE_BIO_TEMPLATE.format(number=number)
-    else:
-        click.secho(f'Cannot find archive_id for {dict_to_name(member)}', fg='yellow')
-        return
+        return Chamber.SENATE, number, SENATE_BIO_TEMPLATE.format(number=number)
 
-    click.secho(f'Updating Bio for {chamber} Member #{number}: '
-                f'{member["first"]} {member["last"]} {member["suffix"] or ""}', fg='bright_yellow', nl=False)
-    click.secho(f' ({url})', fg='bright_black')
-    soup = get_page(url, f'{chamber}Bio')
 
-    err = soup.find('div', class_='Message-Error')
-    if err:
-        click.secho(f'\t{err.text.strip()}', fg='red')
-        return
+def parse_bio(soup, chamber):
+    """Return the name dict, date of birth and service of a member, along with (district, party, years) terms.
 
+    Raises a RuntimeError if the service table has an office that is not a seat in the chamber"""
     dob = None
     if chamber == Chamber.HOUSE:
         div = soup.find('div', class_='bio-table')
@@ -581,9 +754,8 @@ def update_member(db, member):
             dob = stamp.date()
     prev = None
     years = []
-
-    if not assert_names_equal(member, name_dict):
-        return
+    terms = []
+    services = []
 
     for row in table.find_all('tr'):
         if row.find('th'):
@@ -598,8 +770,7 @@ def update_member(db, member):
         elif office == 'Chief Clerk':
             continue
         elif office:
-            click.secho(f'Weird office: {office}', bg='yellow')
-            exit(0)
+            raise RuntimeError(f'Weird office: {office}')
         # position = cells[2]
         if cells[3] in ['N/A', '']:
             district = None
@@ -613,7 +784,7 @@ def update_member(db, member):
 
         key = district or '?', party
         if prev and key != prev:
-            click.secho(f'\t#{prev[0]} {prev[1]} {condense(years)}')
+            terms.append((prev, years))
             years = []
         prev = key
 
@@ -622,20 +793,255 @@ def update_member(db, member):
         for year in session_years:
             years.append(year)
 
-            service = {'member_id': mid,
-                       'chamber': chamber,
-                       'year': year,
-                       'district': district,
-                       'party': party}
-            db.update('service', service, ['member_id', 'year', 'chamber'])
+            services.append({'chamber': chamber,
+                             'year': year,
+                             'district': district,
+                             'party': party})
     if prev:
-        click.secho(f'\t#{prev[0]} {prev[1]} {condense(years)}')
-    else:
+        terms.append((prev, years))
+    return name_dict, dob, services, terms
+
+
+def fetch_member(member):
+    """Download and parse a member's biography. Returns None if there is none, or an error message instead of the bio"""
+    request = get_bio_request(member)
+    if request is None:
+        return
+    chamber, number, url = request
+    soup = get_page(url)
+
+    err = soup.find('div', class_='Message-Error')
+    if err:
+        return request, err.text.strip(), None
+    try:
+        return request, None, parse_bio(soup, chamber)
+    except RuntimeError as e:
+        return request, str(e), None
+
+
+def write_member(db, member, fetched):
+    mid = member['id']
+    if fetched is None:
+        click.secho(f'Cannot find archive_id for {dict_to_name(member)}', fg='yellow')
+        return
+
+    (chamber, number, url), err, bio = fetched
+    click.secho(f'Updating Bio for {chamber} Member #{number}: '
+                f'{member["first"]} {member["last"]} {member["suffix"] or ""}', fg='bright_yellow', nl=False)
+    click.secho(f' ({url})', fg='bright_black')
+
+    if err:
+        click.secho(f'\t{err}', fg='red')
+        return
+
+    name_dict, dob, services, terms = bio
+    if not assert_names_equal(member, name_dict):
+        return
+
+    for (district, party), years in terms:
+        click.secho(f'\t#{district} {party} {condense(years)}')
+    if not terms:
         click.secho('\tWarning: No Service Found!', fg='yellow')
 
+    db.update_service([dict(row, member_id=mid) for row in services])
     db.update('members', {'id': mid, 'dob': dob, 'last_crawl': datetime.datetime.now()})
 
 
+def update_member(db, member):
+    write_item(db, write_member, member, fetch_member(member))
+
+
+def get_member_list_work(db):
+    """Map the member_crawl name of each member list to (fetch method, fetch args, write method, write args)"""
+    potential_work = {}
+    # Update Historical Senate List
+    potential_work['*'] = get_senator_list_work()
+
+    # Update Historical Representative List
+    for letter in range(ord('A'), ord('Z') + 1):
+        potential_work[chr(letter)] = get_representative_list_work(chr(letter))
+
+    # Add Current Lists
+    for chamber in Chamber:
+        potential_work['Current ' + chamber.name] = get_current_roll_work(chamber)
+
+    # Add Past Recent Lists
+    for update_name in db.lookup_all('name', 'member_crawl', 'WHERE name LIKE "2%" ORDER BY name'):
+        year_s, chamber_s = update_name.split(' ')
+        year = int(year_s)
+        chamber = Chamber[chamber_s]
+        potential_work[update_name] = get_current_roll_work(chamber, year)
+    return potential_work
+
+
+def needs_member_list_crawl(db, crawl_name):
+    last_crawl = db.lookup('last_crawl', 'member_crawl', {'name': crawl_name})
+
+    # TODO: Update to recrawl
+    if last_crawl:
+        if 'Current' not in crawl_name or datetime.datetime.now() - last_crawl < datetime.timedelta(days=7):
+            return False
+    return True
+
+
+def fetch_member_list(list_work):
+    """list_work is the member_crawl name and its entry from get_member_list_work. Does not touch the db"""
+    crawl_name, (fetch_method, fetch_args, write_method, write_args) = list_work
+    return fetch_method(*fetch_args)
+
+
+def write_member_list(db, list_work, fetched):
+    crawl_name, (fetch_method, fetch_args, write_method, write_args) = list_work
+    write_method(db, *write_args, fetched)
+    db.update('member_crawl', {'name': crawl_name, 'last_crawl': datetime.datetime.now()}, 'name')
+
+
+def update_member_list(db, crawl_name):
+    list_work = crawl_name, get_member_list_work(db)[crawl_name]
+    write_item(db, write_member_list, list_work, fetch_member_list(list_work))
+
+
+UPDATE_METHODS = {
+    'session': lambda db, session: update_session_years(db, session['chamber'], session['year'],
+                                                        session['session_index']),
+    'day': update_day,
+    'roll': update_roll,
+    'bio': update_member,
+}
+
+TASK_TABLES = {
+    'session': 'sessions',
+    'day': 'session_days',
+    'roll': 'roll_calls',
+    'bio': 'members',
+}
+
+# Work discovered by completing a task of the given kind
+FOLLOW_UP_QUERIES = {
+    'session': ('day', 'SELECT * FROM session_days WHERE session_id=:item_id AND last_crawl IS NULL '
+                       'ORDER BY date DESC'),
+    'day': ('roll', 'SELECT * FROM roll_calls WHERE day_id=:item_id AND last_crawl IS NULL ORDER BY number'),
+    'member_list': ('bio', 'SELECT * FROM members WHERE last_crawl IS NULL'),
+}
+
+
+def refresh(db, kind, row):
+    before = get_signature(db, kind, row['id'])
+    with METRICS.stage(KIND_STAGES[kind]):
+        UPDATE_METHODS[kind](db, row)
+    record_refresh(db, kind, row['id'], before, get_signature(db, kind, row['id']))
+
+
+def run_task(db, task):
+    with METRICS.stage(KIND_STAGES[task['kind']]):
+        run_task_in_stage(db, task)
+
+
+def run_task_in_stage(db, task):
+    kind = task['kind']
+    if kind == 'member_list':
+        update_member_list(db, task['name'])
+    else:
+        row = db.select_one(TASK_TABLES[kind], clause={'id': task['item_id']})
+        if row is None:
+            click.secho(f'Cannot find {kind} #{task["item_id"]}', fg='yellow')
+            return
+        UPDATE_METHODS[kind](db, row)
+
+    if kind in FOLLOW_UP_QUERIES:
+        follow_up_kind, query = FOLLOW_UP_QUERIES[kind]
+        for row in list(db.query(query, {'item_id': task['item_id']})):
+            work_queue.enqueue(db, follow_up_kind, row['id'])
+
+
+def crawl_pipeline(db, sessions, days, rolls, workers=1, day_limit=None, roll_limit=None, min_year=None):
+    """Crawl sessions, days and rolls as a stream instead of in phases.
+
+    As soon as a session (or day) is written, the uncrawled days (or rolls) it found are queued, so all three stages
+    run at the same time. Fetching and parsing happen on worker threads, and writing happens on this thread only.
+
+    The days and rolls that are found along the way count against day_limit and roll_limit (None for no limit) like
+    the ones passed in, and days before min_year are skipped."""
+    pending = {}
+    seen = set()
+    limits = {'day': day_limit, 'roll': roll_limit}
+    submitted = collections.Counter()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        def submit(kind, row):
+            if (kind, row['id']) in seen:
+                return
+            if limits.get(kind) is not None and submitted[kind] >= limits[kind]:
+                return
+            if kind == 'day' and min_year is not None and row['date'].year < min_year:
+                return
+            seen.add((kind, row['id']))
+            submitted[kind] += 1
+            stage = KIND_STAGES[kind]
+            if kind == 'session':
+                future = executor.submit(METRICS.call_in_stage, stage, fetch_session,
+                                         (row['chamber'], row['year'], row['session_index']))
+            elif kind == 'day':
+                future = executor.submit(METRICS.call_in_stage, stage, fetch_day, get_day_request(db, row))
+            else:
+                future = executor.submit(METRICS.call_in_stage, stage, fetch_roll, row)
+            pending[future] = kind, row
+
+        for kind, rows in [('session', sessions), ('day', days), ('roll', rolls)]:
+            for row in rows:
+                submit(kind, row)
+
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                kind, row = pending.pop(future)
+                with METRICS.stage(KIND_STAGES[kind]):
+                    if kind == 'session':
+                        write_item(db, write_session, (row['chamber'], row['year'], row['session_index']),
+                                   future.result())
+                    elif kind == 'day':
+                        write_item(db, write_day, row, future.result())
+                    else:
+                        write_item(db, write_roll, row, future.result())
+
+                if kind in FOLLOW_UP_QUERIES:
+                    follow_up_kind, query = FOLLOW_UP_QUERIES[kind]
+                    for follow_up in list(db.query(query, {'item_id': row['id']})):
+                        submit(follow_up_kind, follow_up)
+
+
+def work(db, lease):
+    """Claim and complete tasks from the work queue until it is empty.
+
+    Several processes can run this at once. If one dies, its lease expires and another process redoes the task.
+    A task that raises an error is released to be retried, up to work_queue.MAX_ATTEMPTS times."""
+    owner = f'{socket.gethostname()}:{os.getpid()}'
+    db.execute('PRAGMA busy_timeout = 60000')
+    completed = 0
+    errors = 0
+    while True:
+        task = work_queue.claim(db, owner, lease)
+        if task is None:
+            break
+        try:
+            run_task(db, task)
+        except Exception as e:
+            db.raw_db.rollback()
+            click.secho(f'Error in {task["kind"]} task #{task["id"]} '
+                        f'(attempt {task["attempts"]}/{work_queue.MAX_ATTEMPTS}): {e!r}', fg='red')
+            work_queue.release(db, task)
+            errors += 1
+            continue
+        db.write()
+        work_queue.complete(db, task)
+        completed += 1
+    click.secho(f'{completed} tasks completed by {owner}', fg='bright_white', nl=False)
+    if errors:
+        click.secho(f' ({errors} errors)', fg='yellow')
+    else:
+        click.secho('')
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-y', '--min-year', type=int)
@@ -645,8 +1051,54 @@ if __name__ == '__main__':
     parser.add_argument('-m', '--update-members', dest='member_limit', type=int, default=0, nargs='?')
     parser.add_argument('-b', '--update-bios', dest='bio_limit', type=int, default=0, nargs='?')
     parser.add_argument('-a', '--update-all', type=int, default=0, nargs='?')
+    parser.add_argument('-f', '--refresh', dest='refresh_budget', type=int, default=0,
+                        help='Number of already crawled pages to recrawl, chosen by age, openness and change rate')
+    mode_group = parser.add_mutually_exclusive_group()
+    mode_group.add_argument('-e', '--enqueue', action='store_true',
+                            help='Add the selected work to the work queue instead of doing it')
+    mode_group.add_argument('-p', '--pipeline', action='store_true',
+                            help='Crawl sessions, days and rolls at the same time, following each new day/roll '
+                                 'immediately (within the day/roll limits and --min-year)')
+    parser.add_argument('-q', '--work', action='store_true',
+                        help='Work through the work queue (can be run in several processes at once)')
+    parser.add_argument('--lease', type=float, default=10.0,
+                        help='Minutes a worker may hold a task before another worker can reclaim it')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of pages to fetch concurrently')
+    parser.add_argument('--per-host', type=int, default=2, help='Maximum simultaneous requests to a single host')
+    parser.add_argument('--min-interval', type=float, default=0.0,
+                        help='Minimum number of seconds between starting requests to a single host')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Seconds to wait for a connection/response')
+    parser.add_argument('--retries', type=int, default=5, help='Number of times to retry failed requests')
+    parser.add_argument('--backoff', type=float, default=0.5, help='Base of the exponential backoff between retries')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the page cache')
+    parser.add_argument('--cache-ttl', type=float, default=24.0,
+                        help='Hours that a cached page is used without revalidating it with the server')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_BYTES // 1024 // 1024,
+                        help='Maximum size of the page cache in megabytes')
+    parser.add_argument('--parser', choices=['html.parser', 'lxml'], default='html.parser',
+                        help='Backend for BeautifulSoup (lxml is faster, but must be installed)')
+    parser.add_argument('--record', metavar='ARCHIVE', help='Record every fetched page to this replay archive')
+    parser.add_argument('--replay', metavar='URL', help='Fetch pages from this replay server (see replay.py)')
+    parser.add_argument('--metrics-json', metavar='PATH', help='Write the per-stage crawl metrics to this JSON file')
+    parser.add_argument('--metrics-prom', metavar='PATH',
+                        help='Write the per-stage crawl metrics to this Prometheus textfile (*.prom)')
+    parser.add_argument('--progress', type=float, metavar='SECONDS',
+                        help='Print a progress summary this often, and a table of the metrics at the end')
     args = parser.parse_args()
 
+    PARSER = args.parser
+    WORKERS = args.workers
+    METRICS = CrawlMetrics(progress_interval=args.progress)
+
+    if args.no_cache:
+        cache = None
+    else:
+        cache = PageCache(ttl=args.cache_ttl * 3600, max_bytes=args.cache_size * 1024 * 1024)
+    archive = ReplayArchive(args.record) if args.record else None
+    FETCHER = Fetcher(timeout=args.timeout, retries=args.retries, backoff=args.backoff,
+                      max_concurrent=args.per_host, min_interval=args.min_interval, cache=cache,
+                      archive=archive, replay_url=args.replay, metrics=METRICS)
+
     if args.update_all != 0:
         args.session_limit = args.update_all
         args.day_limit = args.update_all
@@ -654,15 +1106,14 @@ if __name__ == '__main__':
         args.member_limit = args.update_all
         args.bio_limit = args.update_all
 
-    # TODO: Update for recency
     crawl_clause = 'last_crawl IS NULL'
     year_clause = '' if args.min_year is None else f'AND year >= {args.min_year}'
 
     with PALegislatureDB() as db:
-        for table in ['sessions', 'session_days', 'roll_calls', 'member_crawl', 'members']:
-            n = db.count(table)
-            c = db.count(table, {'last_crawl': None})
-            r = n - c
+        import_legacy_resolutions(db)
+
+        for table, n, r in db.get_crawl_counts():
+            c = n - r
             click.secho(f'{table:15s} ', fg='bright_white', nl=False)
             if n == 0:
                 click.secho('     ', fg='bright_white', nl=False)
@@ -672,67 +1123,100 @@ if __name__ == '__main__':
                 click.secho(f'{100 * r // n:3}% ', nl=False)
             click.secho(f'{r:5}/{n:5}')
 
+        listed_session_ids = []
         if args.session_limit is None or args.session_limit > 0:
             most_recent = db.lookup('last_crawl', 'sessions', 'WHERE last_crawl IS NOT NULL ORDER BY last_crawl DESC')
 
             if not most_recent or (datetime.datetime.now() - most_recent) > datetime.timedelta(days=1):
-                update_session_years(db, Chamber.HOUSE)
-                update_session_years(db, Chamber.SENATE)
+                with METRICS.stage('sessions'):
+                    listed_session_ids.append(update_session_years(db, Chamber.HOUSE))
+                    listed_session_ids.append(update_session_years(db, Chamber.SENATE))
 
             limit_clause = '' if args.session_limit is None else f'LIMIT {args.session_limit}'
-
-            for session in db.query(f'SELECT * FROM sessions WHERE {crawl_clause} {year_clause} '
-                                    f'ORDER BY year, chamber, session_index {limit_clause}'):
-                update_session_years(db, session['chamber'], session['year'], session['session_index'])
+            session_query = (f'SELECT * FROM sessions WHERE {crawl_clause} {year_clause} '
+                             f'ORDER BY year, chamber, session_index {limit_clause}')
+        else:
+            session_query = 'SELECT * FROM sessions LIMIT 0'
 
         limit_clause = '' if args.day_limit is None else f'LIMIT {args.day_limit}'
         date_clause = '' if args.min_year is None else f'AND DATE(date) >= "{args.min_year}-01-01"'
-        for day in db.query(f'SELECT id, session_id, date FROM session_days WHERE {crawl_clause} {date_clause} '
-                            f'ORDER BY date DESC {limit_clause}'):
-            update_day(db, day)
+        day_query = (f'SELECT id, session_id, date FROM session_days WHERE {crawl_clause} {date_clause} '
+                     f'ORDER BY date DESC {limit_clause}')
 
         limit_clause = '' if args.roll_limit is None else f'LIMIT {args.roll_limit}'
-        for roll in db.query(f'SELECT * FROM roll_calls WHERE {crawl_clause} '
-                             f'ORDER BY -session_year, number {limit_clause}'):
-            update_roll(db, roll)
+        roll_query = f'SELECT * FROM roll_calls WHERE {crawl_clause} ORDER BY -session_year, number {limit_clause}'
+
+        if args.pipeline:
+            days = list(db.query(day_query))
+            # The session list pages are also the pages for the current sessions, so follow their days too
+            for session_id in listed_session_ids:
+                days += db.query(FOLLOW_UP_QUERIES['session'][1], {'item_id': session_id})
+            crawl_pipeline(db, list(db.query(session_query)), days, list(db.query(roll_query)), args.workers,
+                           args.day_limit, args.roll_limit, args.min_year)
+        else:
+            with METRICS.stage('sessions'):
+                for session in db.query(session_query):
+                    if args.enqueue:
+                        work_queue.enqueue(db, 'session', session['id'])
+                    else:
+                        update_session_years(db, session['chamber'], session['year'], session['session_index'])
+
+            with METRICS.stage('days'):
+                for day in db.query(day_query):
+                    if args.enqueue:
+                        work_queue.enqueue(db, 'day', day['id'])
+                    else:
+                        update_day(db, day)
+
+            with METRICS.stage('rolls'):
+                rolls = db.query(roll_query)
+                if args.enqueue:
+                    for roll in rolls:
+                        work_queue.enqueue(db, 'roll', roll['id'])
+                else:
+                    crawl_concurrently(db, rolls, fetch_roll, write_roll, args.workers)
 
         if args.member_limit is None or args.member_limit > 0:
-            potential_work = []
-            # Update Historical Senate List
-            potential_work.append(('*', update_senator_list, []))
-
-            # Update Historical Representative List
-            for letter in range(ord('A'), ord('Z') + 1):
-                potential_work.append((chr(letter), update_representative_list, [chr(letter)]))
-
-            # Add Current Lists
-            for chamber in Chamber:
-                potential_work.append(('Current ' + chamber.name, update_current_roll, [chamber]))
-
-            # Add Past Recent Lists
-            for update_name in db.lookup_all('name', 'member_crawl', 'WHERE name LIKE "2%" ORDER BY name'):
-                year_s, chamber_s = update_name.split(' ')
-                year = int(year_s)
-                chamber = Chamber[chamber_s]
-                potential_work.append((update_name, update_current_roll, [chamber, year]))
-
-            completed = 0
-            for crawl_name, update_method, arg_list in potential_work:
-                last_crawl = db.lookup('last_crawl', 'member_crawl', {'name': crawl_name})
-
-                # TODO: Update to recrawl
-                if last_crawl:
-                    if 'Current' not in crawl_name or datetime.datetime.now() - last_crawl < datetime.timedelta(days=7):
-                        continue
-
-                update_method(db, *arg_list)
-
-                db.update('member_crawl', {'name': crawl_name, 'last_crawl': datetime.datetime.now()}, 'name')
-
-                completed += 1
-                if args.member_limit is not None and completed >= args.member_limit:
-                    break
+            member_list_work = get_member_list_work(db)
+            crawl_names = [name for name in member_list_work if needs_member_list_crawl(db, name)]
+            if args.member_limit is not None:
+                crawl_names = crawl_names[:args.member_limit]
+
+            if args.enqueue:
+                for crawl_name in crawl_names:
+                    work_queue.enqueue(db, 'member_list', name=crawl_name)
+            else:
+                with METRICS.stage('member_lists'):
+                    crawl_concurrently(db, [(name, member_list_work[name]) for name in crawl_names],
+                                       fetch_member_list, write_member_list, args.workers)
 
         limit_clause = '' if args.bio_limit is None else f'LIMIT {args.bio_limit}'
-        for member in db.query(f'SELECT * FROM members WHERE {crawl_clause} ORDER BY last, first {limit_clause}'):
-            update_member(db, member)
+        members = list(db.query(f'SELECT * FROM members WHERE {crawl_clause} ORDER BY last, first {limit_clause}'))
+        if args.enqueue:
+            for member in members:
+                work_queue.enqueue(db, 'bio', member['id'])
+        else:
+            with METRICS.stage('bios'):
+                crawl_concurrently(db, members, fetch_member, write_member, args.workers)
+
+        if args.enqueue:
+            db.write()
+            click.secho(f'{work_queue.pending_count(db)} tasks in the work queue', fg='bright_white')
+
+        if args.work:
+            work(db, datetime.timedelta(minutes=args.lease))
+
+        if args.refresh_budget > 0:
+            for kind, row in plan_refreshes(db, args.refresh_budget, datetime.timedelta(hours=args.cache_ttl)):
+                refresh(db, kind, row)
+
+        if db.lock_wait_seconds:
+            click.secho(f'Waited {db.lock_wait_seconds:.1f}s in total for other processes to release the database',
+                        fg='yellow')
+
+    if args.progress is not None:
+        METRICS.print_summary()
+    if args.metrics_json:
+        METRICS.write_json(args.metrics_json)
+    if args.metrics_prom:
+        METRICS.write_prometheus(args.metrics_prom)
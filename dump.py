@@ -1,101 +1,342 @@
 #!/usr/bin/python3
+import argparse
+import array
 import click
 import collections
+import concurrent.futures
+import contextlib
 import csv
+import datetime
+import importlib.util
+import io
+import multiprocessing
 import pathlib
+import yaml
+
+from pa_legislature import PALegislatureDB, NAMED_VOTES
+from names import dict_to_name, NAME_FIELDS
+import change_feed
+
+ROOT_FOLDER = pathlib.Path('vote_data')
+
+# The export_versions that each file was last written from (see PALegislatureDB.get_export_versions)
+VERSIONS_PATH = ROOT_FOLDER / '.export_versions.yaml'
+
+# Columnar copy of the data (requires pyarrow). The tables other than members are partitioned by year and chamber
+PARQUET_FOLDER = pathlib.Path('vote_parquet')
+PARTITIONED_TABLES = ['rolls', 'service', 'votes']
+
+# The votes of one roll that have been matched to a member
+ROLL_VOTES_QUERY = f'SELECT member_id, vote FROM {NAMED_VOTES} WHERE roll_id=? AND member_id IS NOT NULL'
+
+
+def get_path(year, chamber):
+    return ROOT_FOLDER / str(year) / (chamber.name.title() + '.csv')
+
+
+def get_parquet_path(table, year, chamber):
+    return PARQUET_FOLDER / table / f'year={year}' / f'chamber={chamber.name.title()}' / 'part-0.parquet'
+
+
+def get_outputs(year, chamber, parquet=False):
+    """Return the paths of the files that are written for one year and chamber"""
+    outputs = [get_path(year, chamber)]
+    if parquet:
+        outputs += [get_parquet_path(table, year, chamber) for table in PARTITIONED_TABLES]
+    return outputs
+
+
+def get_session_days(db):
+    """Map each (year, chamber) whose session days have all been crawled to those days"""
+    session_days = collections.defaultdict(list)
+    incomplete = set()
+
+    for session in db.query('SELECT * FROM sessions ORDER BY year'):
+        key = session['year'], session['chamber']
+        if key in incomplete:
+            continue
+        sid = session['id']
+        all_days = list(db.select('session_days', clause={'session_id': sid}))
+
+        # Skip if none found
+        if not all_days:
+            continue
+
+        missing = len([d for d in all_days if d['last_crawl'] is None])
+        if missing > 0:
+            incomplete.add(key)
+            session_days.pop(key, None)
+        else:
+            session_days[key] += all_days
+    return session_days
+
+
+def get_ordered_rolls(days, rolls_by_day):
+    """Return the rolls of the days in order, with the date as the stamp of any roll that does not have one"""
+    rolls = []
+    for day in sorted(days, key=lambda d: d['date']):
+        roll_subset = rolls_by_day[day['id']]
+
+        if any(not roll['stamp'] for roll in roll_subset):
+            # Some stamps missing, order by id
+            for roll in sorted(roll_subset, key=lambda d: d['id']):
+                # Fill in stamp with date
+                if not roll['stamp']:
+                    roll = dict(roll)
+                    roll['stamp'] = day['date']
+                rolls.append(roll)
+        else:
+            rolls += sorted(roll_subset, key=lambda d: d['stamp'])
+    return rolls
+
+
+def iter_roll_votes(db, rolls):
+    """Yield each roll with its votes by member_id, reading the votes of one roll at a time"""
+    for roll in rolls:
+        yield roll, {member_id: vote for member_id, vote in db.execute(ROLL_VOTES_QUERY, [roll['id']])}
+
+
+def collect_votes(roll_votes, columns):
+    """Pass the (roll, votes) pairs through, appending each vote to the roll_id, member_id and vote columns"""
+    for roll, votes in roll_votes:
+        for member_id, vote in votes.items():
+            columns['roll_id'].append(roll['id'])
+            columns['member_id'].append(member_id)
+            columns['vote'].append(vote)
+        yield roll, votes
+
+
+def iter_csv_rows(roll_votes, member_ids):
+    """Yield the csv row of each (roll, votes) pair"""
+    for roll, votes in roll_votes:
+        row = []
+        row.append(roll['name'])
+        row.append(roll['number'])
+        row.append(str(roll['stamp']))
+        for mid in member_ids:
+            if mid in votes:
+                row.append(votes[mid].to_letter())
+            else:
+                row.append('')
+        yield row
+
+
+def write_csv(fn, roll_votes, services):
+    """Write one file, streaming the rows from the (roll, votes) pairs.
+
+    services are the service rows of the year and chamber, with the names of the members. Returns the number of
+    columns"""
+    headers = ['Name', 'Number', 'Date']
+    member_ids = []
+    districts = []
+    parties = []
+    for service in services:
+        member_ids.append(service['member_id'])
+        headers.append(dict_to_name(service))
+        districts.append(service['district'])
+        parties.append(service['party'])
+
+    with open(fn, 'w') as f:
+        csv_writer = csv.writer(f)
+        csv_writer.writerow(headers)
+        if any(districts):
+            csv_writer.writerow(['District', '', ''] + districts)
+        if any(parties):
+            csv_writer.writerow(['Party', '', ''] + parties)
+        csv_writer.writerows(iter_csv_rows(roll_votes, member_ids))
+    return len(headers)
+
+
+def write_parquet(year, chamber, rolls, day_dates, services, votes):
+    """Write the rolls, service and (long format) votes of one year and chamber to their PARQUET_FOLDER partitions.
+
+    votes has the roll_id, member_id and vote columns (see collect_votes)"""
+    import pyarrow
+    import pyarrow.parquet
+
+    tables = {
+        'rolls': pyarrow.table({
+            'roll_id': pyarrow.array([roll['id'] for roll in rolls], pyarrow.int32()),
+            'number': pyarrow.array([roll['number'] for roll in rolls], pyarrow.int32()),
+            'name': pyarrow.array([roll['name'] for roll in rolls], pyarrow.string()),
+            'date': pyarrow.array([day_dates[roll['day_id']] for roll in rolls], pyarrow.date32()),
+            # Unlike the csv, the stamp is null when the roll page did not have one (and it was filled in with the date)
+            'stamp': pyarrow.array([roll['stamp'] if isinstance(roll['stamp'], datetime.datetime) else None
+                                    for roll in rolls], pyarrow.timestamp('s')),
+        }),
+        'service': pyarrow.table({
+            'member_id': pyarrow.array([service['member_id'] for service in services], pyarrow.int32()),
+            'district': pyarrow.array([service['district'] for service in services], pyarrow.int16()),
+            'party': pyarrow.array([service['party'] for service in services], pyarrow.string()),
+        }),
+        'votes': pyarrow.table({
+            'roll_id': pyarrow.array(votes['roll_id'], pyarrow.int32()),
+            'member_id': pyarrow.array(votes['member_id'], pyarrow.int32()),
+            'vote': pyarrow.array(votes['vote'], pyarrow.int8()),
+        }),
+    }
+    for table, data in tables.items():
+        path = get_parquet_path(table, year, chamber)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        pyarrow.parquet.write_table(data, path)
+
+
+def write_members_parquet(db):
+    """Write every member, with the name used in the csv headers, to PARQUET_FOLDER/members.parquet"""
+    import pyarrow
+    import pyarrow.parquet
+
+    members = list(db.query('SELECT * FROM members ORDER BY id'))
+    data = pyarrow.table({
+        'member_id': pyarrow.array([member['id'] for member in members], pyarrow.int32()),
+        'name': pyarrow.array([str(dict_to_name(member)) for member in members], pyarrow.string()),
+        'first': pyarrow.array([member['first'] for member in members], pyarrow.string()),
+        'middle': pyarrow.array([member['middle'] for member in members], pyarrow.string()),
+        'last': pyarrow.array([member['last'] for member in members], pyarrow.string()),
+        'suffix': pyarrow.array([member['suffix'] for member in members], pyarrow.string()),
+        'dob': pyarrow.array([member['dob'] for member in members], pyarrow.date32()),
+    })
+    PARQUET_FOLDER.mkdir(exist_ok=True)
+    pyarrow.parquet.write_table(data, PARQUET_FOLDER / 'members.parquet')
+
+
+def export_slice(db, year, chamber, session_ids, parquet=False, roll_hashes=None):
+    """Write the files of one year and chamber (see get_outputs), reading only the rows of its sessions.
+
+    The days and rolls of the sessions are loaded, but the votes are streamed from the database to the csv one roll at
+    a time. (The columnar votes are collected first, as a few bytes per vote)
+
+    If roll_hashes (the slice's hashes from the change feed state) is given, the records of the rolls that changed
+    are collected as well, for change_feed.append_changes.
+
+    Returns the number of rows and columns of the csv and, with roll_hashes, the changed records and the new hashes.
+    None if there are no rolls to write"""
+    days = list(db.select('session_days', clause={'session_id': session_ids}))
+    rolls_by_day = collections.defaultdict(list)
+    for d in db.select('roll_calls JOIN session_days ON roll_calls.day_id = session_days.id', 'roll_calls.*',
+                       {'session_days.session_id': session_ids}):
+        rolls_by_day[d['day_id']].append(d)
+
+    rolls = get_ordered_rolls(days, rolls_by_day)
+    if not rolls:
+        return
+
+    services = list(db.select('service JOIN members ON service.member_id = members.id',
+                              ['member_id', 'district', 'party'] + NAME_FIELDS, {'year': year, 'chamber': chamber},
+                              order=['district', 'member_id']))
+
+    fn = get_path(year, chamber)
+    fn.parent.mkdir(exist_ok=True)
+    day_dates = {day['id']: day['date'] for day in days}
+    roll_votes = iter_roll_votes(db, rolls)
+    if parquet:
+        votes = {'roll_id': array.array('i'), 'member_id': array.array('i'), 'vote': array.array('b')}
+        roll_votes = collect_votes(roll_votes, votes)
+    feed = None
+    if roll_hashes is not None:
+        feed = [], {}
+        roll_votes = change_feed.collect_changes(roll_votes, year, chamber, day_dates, roll_hashes, *feed)
+    n_columns = write_csv(fn, roll_votes, services)
+    if parquet:
+        write_parquet(year, chamber, rolls, day_dates, services, votes)
+    return len(rolls), n_columns, feed
+
+
+def export_slice_in_worker(job):
+    """export_slice with a read-only connection of its own, for the worker processes"""
+    with contextlib.redirect_stdout(io.StringIO()), PALegislatureDB(read_only=True) as db:
+        return export_slice(db, *job)
+
+
+def export_slices(db, jobs, workers=1):
+    """Yield the result of export_slice for each (year, chamber, session_ids, parquet, roll_hashes) job, in order.
+
+    With more than one worker, the files are written by a pool of processes, each reading its own slice"""
+    if workers <= 1:
+        for job in jobs:
+            yield export_slice(db, *job)
+        return
+
+    # Spawned rather than forked, so that the workers do not inherit the open SQLite connection
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        yield from executor.map(export_slice_in_worker, jobs)
 
-from pa_legislature import PALegislatureDB
-from names import dict_to_name
 
 if __name__ == '__main__':
-    with PALegislatureDB() as db:
-        session_days_by_year_and_chamber = collections.defaultdict(lambda: collections.defaultdict(list))
-        incomplete = set()
+    parser = argparse.ArgumentParser(description='Write the votes of each fully crawled year and chamber to vote_data')
+    parser.add_argument('-f', '--full', action='store_true',
+                        help='Rewrite every file, instead of only those whose data changed since the last export')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of files to write in parallel')
+    parser.add_argument('-p', '--parquet', action='store_true',
+                        help=f'Also write the columnar export to {PARQUET_FOLDER} (requires pyarrow)')
+    parser.add_argument('-c', '--changes', action='store_true',
+                        help=f'Also append the new and changed rolls to the change feed in {change_feed.FEED_FOLDER}')
+    args = parser.parse_args()
 
-        for session in db.query('SELECT * FROM sessions ORDER BY year'):
-            key = session['year'], session['chamber']
-            if key in incomplete:
-                continue
-            sid = session['id']
-            all_days = list(db.query(f'SELECT * FROM session_days WHERE session_id={sid}'))
+    if args.parquet and importlib.util.find_spec('pyarrow') is None:
+        click.secho('The columnar export requires pyarrow (pip install pyarrow)', fg='red')
+        exit(1)
+
+    if VERSIONS_PATH.exists() and not args.full:
+        exported_versions = yaml.safe_load(open(VERSIONS_PATH)) or {}
+    else:
+        exported_versions = {}
+    feed_state = change_feed.load_state() if args.changes else None
+
+    ROOT_FOLDER.mkdir(exist_ok=True)
+    with PALegislatureDB(read_only=True) as db:
+        session_days = get_session_days(db)
+        versions = db.get_export_versions()
 
-            # Skip if none found
-            if not all_days:
+        to_write = []
+        for key in sorted(session_days):
+            # The version that each output was last written from
+            exported = [exported_versions.get(str(fn), 'missing') if fn.exists() else 'missing'
+                        for fn in get_outputs(*key, args.parquet)]
+            if args.changes:
+                exported.append(feed_state['versions'].get(change_feed.get_slice_name(*key), 'missing'))
+            if any(version != versions.get(key) for version in exported):
+                to_write.append(key)
+
+        if len(to_write) < len(session_days):
+            click.secho(f'{len(session_days) - len(to_write)} files are unchanged', fg='bright_black')
+
+        jobs = []
+        for year, chamber in to_write:
+            session_ids = sorted({day['session_id'] for day in session_days[year, chamber]})
+            roll_hashes = None
+            if args.changes:
+                roll_hashes = feed_state['rolls'].get(change_feed.get_slice_name(year, chamber), {})
+            jobs.append((year, chamber, session_ids, args.parquet, roll_hashes))
+
+        last_seq = change_feed.get_last_seq() if args.changes else 0
+
+        # The workers read their own snapshots, which may be newer than versions. That only means that the file is
+        # written again next time
+        for (year, chamber, session_ids, parquet, roll_hashes), result in zip(jobs,
+                                                                              export_slices(db, jobs, args.workers)):
+            if result is None:
                 continue
+            n_rows, n_columns, feed = result
+            click.secho(f'Wrote {str(get_path(year, chamber)):30} {n_rows:4d} rows, {n_columns:3d} columns',
+                        fg='bright_green')
+            for fn in get_outputs(year, chamber, parquet):
+                exported_versions[str(fn)] = versions.get((year, chamber))
 
-            missing = len([d for d in all_days if d['last_crawl'] is None])
-            if missing > 0:
-                incomplete.add(key)
-                session_days_by_year_and_chamber[session['year']].pop(session['chamber'], None)
-            else:
-                session_days_by_year_and_chamber[session['year']][session['chamber']] += all_days
-
-        vote_lookup = collections.defaultdict(dict)
-        for d in db.query('SELECT roll_id, member_id, vote FROM votes WHERE member_id IS NOT NULL'):
-            vote_lookup[d['roll_id']][d['member_id']] = d['vote']
-
-        member_lookup = {d['id']: d for d in db.query('SELECT * FROM members')}
-        roll_lookup = {d['id']: d for d in db.query('SELECT * FROM roll_calls')}
-
-        root_folder = pathlib.Path('vote_data')
-        root_folder.mkdir(exist_ok=True)
-
-        for year in sorted(session_days_by_year_and_chamber):
-            for chamber in sorted(session_days_by_year_and_chamber[year]):
-                days = session_days_by_year_and_chamber[year][chamber]
-
-                rolls = []
-                for day in sorted(days, key=lambda d: d['date']):
-                    roll_subset = [d for d in roll_lookup.values() if d['day_id'] == day['id']]
-
-                    if any(not roll['stamp'] for roll in roll_subset):
-                        # Some stamps missing, order by id
-                        for roll in sorted(roll_subset, key=lambda d: d['id']):
-                            # Fill in stamp with date
-                            if not roll['stamp']:
-                                roll = dict(roll)
-                                roll['stamp'] = day['date']
-                            rolls.append(roll)
-                    else:
-                        rolls += sorted(roll_subset, key=lambda d: d['stamp'])
-                if not rolls:
-                    continue
-
-                year_folder = root_folder / str(year)
-                year_folder.mkdir(exist_ok=True)
-                fn = year_folder / (chamber.name.title() + '.csv')
-
-                headers = ['Name', 'Number', 'Date']
-                member_ids = []
-                districts = []
-                parties = []
-                for service in db.query(f'SELECT * FROM service WHERE year={year} AND chamber={chamber.value} '
-                                        f'ORDER BY district'):
-                    member_ids.append(service['member_id'])
-                    member = member_lookup[service['member_id']]
-                    headers.append(dict_to_name(member))
-                    districts.append(service['district'])
-                    parties.append(service['party'])
-
-                click.secho(f'Writing {str(fn):30} {len(rolls):4d} rows, {len(headers):3d} columns',
-                            fg='bright_green')
-                with open(fn, 'w') as f:
-                    csv_writer = csv.writer(f)
-                    csv_writer.writerow(headers)
-                    if any(districts):
-                        csv_writer.writerow(['District', '', ''] + districts)
-                    if any(parties):
-                        csv_writer.writerow(['Party', '', ''] + parties)
-
-                    for roll in rolls:
-                        row = []
-                        row.append(roll['name'])
-                        row.append(roll['number'])
-                        row.append(str(roll['stamp']))
-                        for mid in member_ids:
-                            if mid in vote_lookup[roll['id']]:
-                                row.append(vote_lookup[roll['id']][mid].to_letter())
-                            else:
-                                row.append('')
-
-                        csv_writer.writerow(row)
+            if feed is not None:
+                changes, hashes = feed
+                if changes:
+                    click.secho(f'\t{len(changes)} new or changed rolls', fg='green')
+                last_seq = change_feed.append_changes(changes, last_seq)
+                slice_name = change_feed.get_slice_name(year, chamber)
+                feed_state['rolls'][slice_name] = hashes
+                feed_state['versions'][slice_name] = versions.get((year, chamber))
+
+        if args.parquet:
+            write_members_parquet(db)
+
+    with open(VERSIONS_PATH, 'w') as f:
+        yaml.safe_dump(exported_versions, f)
+    if args.changes:
+        change_feed.save_state(feed_state)
@@ -0,0 +1,144 @@
+import contextlib
+import requests
+import requests.adapters
+import threading
+import time
+import urllib.parse
+import urllib3.util
+
+from replay import get_replay_url
+
+USER_AGENT = {
+    'User-Agent': 'PALegislature Bot',
+    'From': 'davidvlu@gmail.com'
+}
+
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+
+class HostThrottle:
+    """Limits how many requests can be in flight to each host, and optionally how often they start"""
+
+    def __init__(self, max_concurrent=2, min_interval=0.0):
+        self.max_concurrent = max_concurrent
+        self.min_interval = min_interval
+        self.lock = threading.Lock()
+        self.semaphores = {}
+        self.next_slot = {}
+
+    @contextlib.contextmanager
+    def __call__(self, url):
+        host = urllib.parse.urlparse(url).netloc
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.max_concurrent)
+            semaphore = self.semaphores[host]
+
+        with semaphore:
+            if self.min_interval:
+                with self.lock:
+                    now = time.monotonic()
+                    slot = max(now, self.next_slot.get(host, now))
+                    self.next_slot[host] = slot + self.min_interval
+                time.sleep(slot - now)
+            yield
+
+
+class Fetcher:
+    """Shared HTTP client with keep-alive connection pooling, timeouts and retries with exponential backoff.
+
+    Retries honor the Retry-After header on 429/503 responses. A single Fetcher can be used from multiple threads.
+
+    If archive is a ReplayArchive, every page and redirect is recorded to it. If replay_url is set, requests are sent
+    to that replay server instead of the real sites.
+
+    If metrics is a CrawlMetrics, the latency and size of each request and the outcome of each cache lookup are
+    recorded to it."""
+
+    def __init__(self, timeout=30.0, retries=5, backoff=0.5, max_backoff=60.0, max_concurrent=2, min_interval=0.0,
+                 cache=None, archive=None, replay_url=None, metrics=None):
+        self.timeout = timeout
+        self.cache = cache
+        self.archive = archive
+        self.replay_url = replay_url
+        self.metrics = metrics
+        self.throttle = HostThrottle(max_concurrent, min_interval)
+
+        retry = urllib3.util.Retry(total=retries,
+                                   backoff_factor=backoff,
+                                   backoff_max=max_backoff,
+                                   status_forcelist=RETRY_STATUSES,
+                                   allowed_methods=['GET', 'HEAD'],
+                                   respect_retry_after_header=True)
+        adapter = requests.adapters.HTTPAdapter(max_retries=retry, pool_maxsize=max(max_concurrent, 10))
+
+        self.session = requests.Session()
+        self.session.headers.update(USER_AGENT)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def route(self, url, headers=None):
+        if self.replay_url is None:
+            return url, headers
+        url, host = get_replay_url(self.replay_url, url)
+        headers = dict(headers or {})
+        headers['Host'] = host
+        return url, headers
+
+    def get(self, url, headers=None):
+        with self.throttle(url):
+            url, headers = self.route(url, headers)
+            start = time.perf_counter()
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        if self.metrics:
+            self.metrics.record_request(time.perf_counter() - start, len(response.content))
+        return response
+
+    def get_text(self, url):
+        status, contents = self.get_cached_text(url)
+        if self.archive:
+            self.archive.record('GET', url, status, contents=contents)
+        return contents
+
+    def get_cached_text(self, url):
+        """Return the status and contents of the page, using (and updating) the page cache if there is one.
+
+        Only successful responses are cached, so a page from the cache (or revalidated by a 304) has a 200 status"""
+        if self.cache is None:
+            response = self.get(url)
+            return response.status_code, response.text
+
+        entry = self.cache.lookup(url)
+        if entry:
+            contents = self.cache.read(entry)
+            if contents is None:
+                entry = None
+            elif self.cache.is_fresh(entry):
+                self.count('cache_hits')
+                return 200, contents
+
+        response = self.get(url, self.cache.get_validators(entry) if entry else None)
+        if response.status_code == 304 and entry:
+            self.cache.touch(entry)
+            self.count('cache_revalidations')
+            return 200, contents
+
+        self.count('cache_misses')
+        if response.ok:
+            self.cache.store(url, response.text, response.headers)
+        return response.status_code, response.text
+
+    def count(self, name):
+        if self.metrics:
+            self.metrics.count(name)
+
+    def head(self, url):
+        with self.throttle(url):
+            routed_url, headers = self.route(url)
+            start = time.perf_counter()
+            response = self.session.head(routed_url, headers=headers, timeout=self.timeout, allow_redirects=False)
+        if self.metrics:
+            self.metrics.record_request(time.perf_counter() - start, 0)
+        if self.archive:
+            self.archive.record('HEAD', url, response.status_code, response.headers.get('Location'))
+        return response
@@ -36,7 +36,7 @@ if __name__ == '__main__':
     parser.add_argument('-w', '--write', action='store_true')
     args = parser.parse_args()
 
-    with PALegislatureDB() as db:
+    with PALegislatureDB(read_only=not args.write) as db:
         members = {d['id']: d for d in db.query('SELECT * FROM members')}
         service = collections.defaultdict(list)
         for row in db.query('SELECT * FROM service'):
@@ -83,7 +83,7 @@ if __name__ == '__main__':
                     for key in id_fields:
                         if member[key] is not None:
                             updates[key] = member[key]
-                for row in db.query(f'SELECT * FROM service WHERE member_id={member_id} ORDER BY year'):
+                for row in db.select('service', clause={'member_id': member_id}, order='year'):
                     print('\t\t{chamber} {year}: {party} {district}'.format(**row))
             if updates and args.write:
                 updates['id'] = member_id1
@@ -102,9 +102,9 @@ if __name__ == '__main__':
                             service_set.add(key)
                             new_row = dict(row)
                             new_row['member_id'] = member_id1
-                            clause = db.generate_clause(dict(row))
+                            clause, params = db.build_clause(dict(row))
 
-                            db.execute(f'UPDATE service SET member_id=? {clause}', [member_id1])
-                    db.execute(f'DELETE FROM members WHERE id={member_id}')
-                    db.execute(f'DELETE FROM service WHERE member_id={member_id}')
+                            db.execute(f'UPDATE OR IGNORE service SET member_id=? {clause}', [member_id1] + params)
+                    db.delete('members', {'id': member_id})
+                    db.delete('service', {'member_id': member_id})
                 db.update('members', updates)
@@ -5,7 +5,7 @@ import collections
 from nameparser import HumanName
 from tqdm import tqdm
 
-from pa_legislature import PALegislatureDB
+from pa_legislature import PALegislatureDB, NAMED_VOTES
 from names import dict_to_name, name_tuple, is_same_name, from_tuple
 from crawl import SENATE_BIO_TEMPLATE, HOUSE_BIO_TEMPLATE
 
@@ -55,9 +55,9 @@ if __name__ == '__main__':
     parser.add_argument('-u', '--display-urls', action='store_true')
     args = parser.parse_args()
 
-    with PALegislatureDB() as db:
+    with PALegislatureDB(read_only=not args.write) as db:
         rolls = {d['id']: d for d in db.query('SELECT * FROM roll_calls')}
-        statuses = db.get_crawl_statuses(rolls=rolls)
+        statuses = db.get_crawl_statuses()
 
         fully_crawled = set()
         for key, status in sorted(statuses.items()):
@@ -79,16 +79,16 @@ if __name__ == '__main__':
 
         votes = collections.defaultdict(list)
 
-        for d in db.query('SELECT * FROM votes'):
+        for d in db.select(NAMED_VOTES, ['roll_id', 'name_id', 'session_id', 'name', 'member_id']):
             votes[d['roll_id']].append(d)
 
         for roll_id in tqdm(list(db.lookup_all('roll_id', table, clause, distinct=True))):
             roll = rolls[roll_id]
-            roll = db.query_one(f'SELECT * FROM roll_calls WHERE id={roll_id}')
+            roll = db.select_one('roll_calls', clause={'id': roll_id})
             if roll['stamp']:
                 year = roll['stamp'].year
             else:
-                date = db.lookup('date', 'session_days', f'WHERE id={roll["day_id"]}')
+                date = db.lookup('date', 'session_days', {'id': roll['day_id']})
                 year = date.year
             if (year, roll['chamber']) not in fully_crawled:
                 continue
@@ -100,9 +100,8 @@ if __name__ == '__main__':
                 member_lookup = collections.defaultdict(dict)
                 member_id_info = {}
                 c = 0
-                for member_id in db.lookup_all('member_id', 'service',
-                                               f'WHERE year={year} AND chamber={chamber.value}'):
-                    member = dict(db.query_one(f'SELECT * FROM members WHERE id={member_id}'))
+                for member_id in db.lookup_all('member_id', 'service', {'year': year, 'chamber': chamber}):
+                    member = dict(db.select_one('members', clause={'id': member_id}))
                     last = member['last']
                     member_lookup[last.lower()][name_tuple(member)] = member
                     member_id_info[member['id']] = member
@@ -168,7 +167,7 @@ if __name__ == '__main__':
                 if len(missing_vote_names) == 0 and len(unmatched_ids) == 0:
                     # Write values as needed
                     if args.write:
-                        session_ids_to_write = collections.defaultdict(set)
+                        name_ids_to_write = collections.defaultdict(set)
                         roll_ids_count = collections.Counter()
                         for roll_votes in votes:
                             for vote in roll_votes:
@@ -177,15 +176,15 @@ if __name__ == '__main__':
                                 member_id = vote_name_to_id[vote['name']]
                                 key = vote['name'], member_id
                                 roll_ids_count[key] += 1
-                                session_ids_to_write[vote['name'], member_id].add(vote['session_id'])
+                                name_ids_to_write[vote['name'], member_id].add(vote['name_id'])
 
-                        bar = tqdm(sorted(session_ids_to_write.keys()))
+                        bar = tqdm(sorted(name_ids_to_write.keys()))
                         for vote_name, member_id in bar:
-                            session_ids = session_ids_to_write[vote_name, member_id]
+                            name_ids = name_ids_to_write[vote_name, member_id]
                             bar.set_description(f'Writing member_id for {vote_name} to '
                                                 f'{roll_ids_count[vote_name, member_id]} votes')
-                            cmd = f'UPDATE votes SET member_id={member_id} WHERE name="{vote_name}" AND session_id=?'
-                            db.execute_many(cmd, [[session_id] for session_id in session_ids])
+                            db.execute_many('UPDATE vote_names SET member_id=? WHERE id=?',
+                                            [[member_id, name_id] for name_id in name_ids])
 
                     continue
 
@@ -0,0 +1,262 @@
+import bisect
+import click
+import contextlib
+import datetime
+import json
+import os
+import pathlib
+import threading
+import time
+
+STAGES = ['sessions', 'days', 'rolls', 'member_lists', 'bios']
+OTHER_STAGE = 'other'
+
+# Upper bounds (in seconds) of the histogram buckets
+SECONDS_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+HISTOGRAMS = {
+    'fetch_seconds': 'Time waiting for an HTTP response (including retries)',
+    'parse_seconds': 'Time building the BeautifulSoup tree of a page',
+    'write_seconds': 'Time writing one crawled item to the database',
+}
+
+COUNTERS = {
+    'requests': 'HTTP requests sent',
+    'bytes': 'Bytes downloaded',
+    'cache_hits': 'Pages served from the page cache without a request',
+    'cache_revalidations': 'Cached pages the server reported as not modified',
+    'cache_misses': 'Pages that had to be downloaded in full',
+    'items': 'Items (sessions, days, rolls, member lists, bios) written to the database',
+}
+
+PROMETHEUS_PREFIX = 'palegislature_crawl'
+
+
+def bound_label(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+class Histogram:
+    def __init__(self, buckets=SECONDS_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self):
+        """(upper bound, number of observations <= upper bound) pairs, ending with +Inf"""
+        total = 0
+        pairs = []
+        for bound, n in zip(self.buckets + [float('inf')], self.counts):
+            total += n
+            pairs.append((bound, total))
+        return pairs
+
+    def to_dict(self):
+        return {'count': self.count,
+                'sum': self.sum,
+                'mean': self.sum / self.count if self.count else None,
+                'buckets': {bound_label(bound): n for bound, n in self.cumulative_counts()},
+                }
+
+
+class StageMetrics:
+    def __init__(self):
+        self.histograms = {name: Histogram() for name in HISTOGRAMS}
+        self.counters = {name: 0 for name in COUNTERS}
+        self.first = None
+        self.last = None
+
+    def mark(self, now):
+        if self.first is None:
+            self.first = now
+        self.last = now
+
+    def elapsed(self):
+        return self.last - self.first if self.first is not None else 0.0
+
+    def items_per_second(self):
+        elapsed = self.elapsed()
+        return self.counters['items'] / elapsed if elapsed else None
+
+    def cache_hit_rate(self):
+        lookups = self.counters['cache_hits'] + self.counters['cache_revalidations'] + self.counters['cache_misses']
+        if not lookups:
+            return None
+        return (self.counters['cache_hits'] + self.counters['cache_revalidations']) / lookups
+
+    def to_dict(self):
+        d = dict(self.counters)
+        d['elapsed'] = self.elapsed()
+        d['items_per_second'] = self.items_per_second()
+        d['cache_hit_rate'] = self.cache_hit_rate()
+        for name, histogram in self.histograms.items():
+            d[name] = histogram.to_dict()
+        return d
+
+
+class CrawlMetrics:
+    """Per-stage counters and histograms for a crawl. Safe to update from several threads.
+
+    Each thread has a current stage (see stage()), and every observation is added to that stage.
+    crawl.py sets the stage on the main thread, and passes it on to the threads that fetch for it."""
+
+    def __init__(self, progress_interval=None):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.stages = {}
+        self.started = datetime.datetime.now()
+        self.start_time = time.perf_counter()
+        self.progress_interval = progress_interval
+        self.last_progress = self.start_time
+
+    def current_stage(self):
+        return getattr(self.local, 'stage', OTHER_STAGE)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        previous = self.current_stage()
+        self.local.stage = name
+        try:
+            yield
+        finally:
+            self.local.stage = previous
+
+    def call_in_stage(self, name, method, *args):
+        """Call method in the given stage, e.g. from a worker thread"""
+        with self.stage(name):
+            return method(*args)
+
+    def get_stage(self):
+        """Return the StageMetrics of the current stage, marking it as active. Assumes the lock is held"""
+        name = self.current_stage()
+        if name not in self.stages:
+            self.stages[name] = StageMetrics()
+        stage = self.stages[name]
+        stage.mark(time.perf_counter())
+        return stage
+
+    def observe(self, name, value):
+        with self.lock:
+            self.get_stage().histograms[name].observe(value)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.get_stage().counters[name] += n
+        if name == 'items':
+            self.maybe_report()
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def record_request(self, seconds, size):
+        with self.lock:
+            stage = self.get_stage()
+            stage.histograms['fetch_seconds'].observe(seconds)
+            stage.counters['requests'] += 1
+            stage.counters['bytes'] += size
+
+    def get_ordered_stages(self):
+        names = [name for name in STAGES if name in self.stages]
+        names += sorted(name for name in self.stages if name not in STAGES)
+        return [(name, self.stages[name]) for name in names]
+
+    def maybe_report(self):
+        """Print the progress summary if it has been at least progress_interval seconds since the last one"""
+        if self.progress_interval is None:
+            return
+        now = time.perf_counter()
+        if now - self.last_progress < self.progress_interval:
+            return
+        self.last_progress = now
+        self.report()
+
+    def report(self):
+        click.secho(f'[{time.perf_counter() - self.start_time:7.1f}s]', fg='bright_white', nl=False)
+        with self.lock:
+            for name, stage in self.get_ordered_stages():
+                rate = stage.items_per_second()
+                click.secho(f' {name} {stage.counters["items"]}', fg='bright_white', nl=False)
+                if rate is not None:
+                    click.secho(f' ({rate:.1f}/s)', fg='bright_black', nl=False)
+        click.secho('')
+
+    def summary(self):
+        with self.lock:
+            return {'started': self.started.isoformat(),
+                    'elapsed': time.perf_counter() - self.start_time,
+                    'stages': {name: stage.to_dict() for name, stage in self.get_ordered_stages()},
+                    }
+
+    def print_summary(self):
+        click.secho(f'{"stage":12s} {"items":>6s} {"items/s":>8s} {"requests":>8s} {"MB":>7s} {"cache":>6s} '
+                    f'{"fetch s":>8s} {"parse s":>8s} {"write s":>8s}', fg='bright_white')
+        for name, stage in self.summary()['stages'].items():
+            rate = '' if stage['items_per_second'] is None else f'{stage["items_per_second"]:.1f}'
+            hit_rate = '' if stage['cache_hit_rate'] is None else f'{100 * stage["cache_hit_rate"]:.0f}%'
+            click.secho(f'{name:12s} {stage["items"]:6d} {rate:>8s} {stage["requests"]:8d} '
+                        f'{stage["bytes"] / 1024 / 1024:7.1f} {hit_rate:>6s} {stage["fetch_seconds"]["sum"]:8.2f} '
+                        f'{stage["parse_seconds"]["sum"]:8.2f} {stage["write_seconds"]["sum"]:8.2f}')
+
+    def write_json(self, path):
+        write_atomically(path, json.dumps(self.summary(), indent=2) + '\n')
+
+    def write_prometheus(self, path):
+        """Write the metrics in the Prometheus text format, e.g. for the node_exporter textfile collector"""
+        lines = []
+        with self.lock:
+            stages = self.get_ordered_stages()
+
+            for name, help_s in HISTOGRAMS.items():
+                metric = f'{PROMETHEUS_PREFIX}_{name}'
+                lines.append(f'# HELP {metric} {help_s}')
+                lines.append(f'# TYPE {metric} histogram')
+                for stage_name, stage in stages:
+                    histogram = stage.histograms[name]
+                    for bound, n in histogram.cumulative_counts():
+                        lines.append(f'{metric}_bucket{{stage="{stage_name}",le="{bound_label(bound)}"}} {n}')
+                    lines.append(f'{metric}_sum{{stage="{stage_name}"}} {histogram.sum}')
+                    lines.append(f'{metric}_count{{stage="{stage_name}"}} {histogram.count}')
+
+            for name, help_s in COUNTERS.items():
+                metric = f'{PROMETHEUS_PREFIX}_{name}_total'
+                lines.append(f'# HELP {metric} {help_s}')
+                lines.append(f'# TYPE {metric} counter')
+                for stage_name, stage in stages:
+                    lines.append(f'{metric}{{stage="{stage_name}"}} {stage.counters[name]}')
+
+            metric = f'{PROMETHEUS_PREFIX}_items_per_second'
+            lines.append(f'# HELP {metric} Items written per second while the stage was active')
+            lines.append(f'# TYPE {metric} gauge')
+            for stage_name, stage in stages:
+                lines.append(f'{metric}{{stage="{stage_name}"}} {stage.items_per_second() or 0.0}')
+
+        metric = f'{PROMETHEUS_PREFIX}_last_run_seconds'
+        lines.append(f'# HELP {metric} Duration of the last crawl')
+        lines.append(f'# TYPE {metric} gauge')
+        lines.append(f'{metric} {time.perf_counter() - self.start_time}')
+
+        metric = f'{PROMETHEUS_PREFIX}_last_run_timestamp_seconds'
+        lines.append(f'# HELP {metric} When the last crawl started')
+        lines.append(f'# TYPE {metric} gauge')
+        lines.append(f'{metric} {self.started.timestamp()}')
+
+        write_atomically(path, '\n'.join(lines) + '\n')
+
+
+def write_atomically(path, contents):
+    """Write then rename, so that readers (like node_exporter) never see a partial file"""
+    path = pathlib.Path(path)
+    temp_path = path.with_name(f'.{path.name}.{os.getpid()}')
+    temp_path.write_text(contents)
+    os.replace(temp_path, path)
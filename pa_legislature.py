@@ -1,7 +1,12 @@
 import bidict
-import collections
+import click
 from metro_db import MetroDB
+from metro_db.types import DatabaseError, FlexibleIterator
+import contextlib
 from enum import IntEnum
+import sqlite3
+import time
+import yaml
 
 
 class Chamber(IntEnum):
@@ -41,50 +46,555 @@ Vote.from_letter = lambda s: VOTE_CODES[s]
 Vote.to_letter = lambda v: VOTE_CODES.inverse[v]
 
 
+# Connection tuning. A negative cache_size is in KiB instead of pages
+CACHE_SIZE_KB = 64 * 1024
+MMAP_SIZE = 256 * 1024 * 1024
+
+# SQLite waits this long for another connection's lock before the wait is reported. Then it keeps waiting, up to
+# LOCK_TIMEOUT_SECONDS in total
+LOCK_REPORT_SECONDS = 1.0
+LOCK_TIMEOUT_SECONDS = 600.0
+
+# The votes with the voter names, session_id and member_id from vote_names. For use as the table of select etc.
+NAMED_VOTES = 'votes JOIN vote_names ON votes.name_id = vote_names.id'
+
+STATUS_FIELDS = 'year, chamber, day_total, day_crawled, roll_total, roll_crawled'
+
+# Adds the counts of one row (OLD or NEW) to the crawl_status of its year and chamber, with sign + or -
+STATUS_UPSERT = f"""INSERT INTO crawl_status ({STATUS_FIELDS}) {{select}}
+ ON CONFLICT (year, chamber) DO UPDATE SET
+ day_total = day_total + excluded.day_total, day_crawled = day_crawled + excluded.day_crawled,
+ roll_total = roll_total + excluded.roll_total, roll_crawled = roll_crawled + excluded.roll_crawled;"""
+DAY_STATUS = 'SELECT year, chamber, {sign}1, {sign}({row}.last_crawl IS NOT NULL), 0, 0 FROM sessions ' \
+             'WHERE sessions.id = {row}.session_id'
+ROLL_STATUS = 'SELECT year, chamber, 0, 0, {sign}1, {sign}({row}.last_crawl IS NOT NULL) FROM session_days ' \
+              'JOIN sessions ON session_days.session_id = sessions.id WHERE session_days.id = {row}.day_id'
+
+# Recomputes crawl_status from scratch
+STATUS_QUERY = """SELECT year, chamber, SUM(day_total), SUM(day_crawled), SUM(roll_total), SUM(roll_crawled) FROM (
+ SELECT year, chamber, COUNT(*) AS day_total, COUNT(session_days.last_crawl) AS day_crawled,
+  0 AS roll_total, 0 AS roll_crawled
+ FROM session_days JOIN sessions ON session_days.session_id = sessions.id GROUP BY year, chamber
+ UNION ALL
+ SELECT sessions.year, sessions.chamber, 0, 0, COUNT(*), COUNT(roll_calls.last_crawl)
+ FROM roll_calls JOIN session_days ON roll_calls.day_id = session_days.id
+ JOIN sessions ON session_days.session_id = sessions.id GROUP BY sessions.year, sessions.chamber
+) GROUP BY year, chamber"""
+
+
+# Any change to a roll's votes discards its packed copy (see packed_votes.py)
+UNPACK_ROLL = 'DELETE FROM packed_rolls WHERE roll_id = {row}.roll_id;'
+
+# Bumps the export_versions of the year(s) and chamber(s) selected for one row (OLD or NEW), so that dump.py knows to
+# rewrite their files
+EXPORT_UPSERT = """INSERT INTO export_versions (year, chamber, version) {select}
+ ON CONFLICT (year, chamber) DO UPDATE SET version = version + 1;"""
+SESSION_KEY = 'SELECT year, chamber, 1 FROM sessions WHERE sessions.id = {row}.session_id'
+DAY_KEY = 'SELECT year, chamber, 1 FROM session_days JOIN sessions ON session_days.session_id = sessions.id ' \
+          'WHERE session_days.id = {row}.day_id'
+ROLL_KEY = 'SELECT sessions.year, sessions.chamber, 1 FROM roll_calls ' \
+           'JOIN session_days ON roll_calls.day_id = session_days.id ' \
+           'JOIN sessions ON session_days.session_id = sessions.id WHERE roll_calls.id = {row}.roll_id'
+
+# (table, the exported fields, how to find the year and chamber of a row, whether inserts and deletes matter)
+# New vote_names and members are not exported until there are votes or service that refer to them
+EXPORTED_TABLES = [
+    ('session_days', 'session_id, date, last_crawl', SESSION_KEY, True),
+    ('roll_calls', 'day_id, number, name, stamp', DAY_KEY, True),
+    ('votes', 'roll_id, name_id, vote', ROLL_KEY, True),
+    ('vote_names', 'member_id', SESSION_KEY, False),
+    ('service', 'member_id, year, chamber, district, party', 'SELECT {row}.year, {row}.chamber, 1 WHERE true', True),
+    ('members', 'first, middle, last, suffix', 'SELECT year, chamber, 1 FROM service WHERE member_id = {row}.id',
+     False),
+]
+
+
+def get_triggers():
+    """Map the name of each trigger that maintains crawl_status, packed_rolls or export_versions to its CREATE
+    statement"""
+    triggers = {}
+    for table, status_select, key in [('session_days', DAY_STATUS, 'session_id'),
+                                      ('roll_calls', ROLL_STATUS, 'day_id')]:
+        added = STATUS_UPSERT.format(select=status_select.format(sign='', row='NEW'))
+        removed = STATUS_UPSERT.format(select=status_select.format(sign='-', row='OLD'))
+        triggers[f'{table}_status_insert'] = f'CREATE TRIGGER {table}_status_insert AFTER INSERT ON {table} ' \
+                                             f'BEGIN {added} END'
+        triggers[f'{table}_status_delete'] = f'CREATE TRIGGER {table}_status_delete AFTER DELETE ON {table} ' \
+                                             f'BEGIN {removed} END'
+        triggers[f'{table}_status_update'] = f'CREATE TRIGGER {table}_status_update AFTER UPDATE OF {key}, ' \
+                                             f'last_crawl ON {table} BEGIN {removed} {added} END'
+
+    unpack_new = UNPACK_ROLL.format(row='NEW')
+    unpack_old = UNPACK_ROLL.format(row='OLD')
+    triggers['votes_packed_insert'] = f'CREATE TRIGGER votes_packed_insert AFTER INSERT ON votes BEGIN {unpack_new} END'
+    triggers['votes_packed_delete'] = f'CREATE TRIGGER votes_packed_delete AFTER DELETE ON votes BEGIN {unpack_old} END'
+    triggers['votes_packed_update'] = 'CREATE TRIGGER votes_packed_update AFTER UPDATE OF roll_id, name_id, vote ' \
+                                      f'ON votes BEGIN {unpack_old} {unpack_new} END'
+
+    for table, fields, key_select, rows_matter in EXPORTED_TABLES:
+        bump_new = EXPORT_UPSERT.format(select=key_select.format(row='NEW'))
+        bump_old = EXPORT_UPSERT.format(select=key_select.format(row='OLD'))
+        if rows_matter:
+            triggers[f'{table}_export_insert'] = f'CREATE TRIGGER {table}_export_insert AFTER INSERT ON {table} ' \
+                                                 f'BEGIN {bump_new} END'
+            triggers[f'{table}_export_delete'] = f'CREATE TRIGGER {table}_export_delete AFTER DELETE ON {table} ' \
+                                                 f'BEGIN {bump_old} END'
+        triggers[f'{table}_export_update'] = f'CREATE TRIGGER {table}_export_update AFTER UPDATE OF {fields} ' \
+                                             f'ON {table} BEGIN {bump_old} {bump_new} END'
+    return triggers
+
+
 class PALegislatureDB(MetroDB):
-    def __init__(self):
+    """MetroDB that also applies the unique_keys, without_rowid and indexes sections of the yaml.
+
+    The select/lookup/count/update/delete helpers take the same clause specs as MetroDB's, but bind the values as
+    parameters instead of formatting them into the SQL. Each statement then has the same text every time it runs,
+    so sqlite3's statement cache can reuse the prepared statement, and values with quotes in them are safe.
+
+    The database uses WAL journaling, so readers do not block the crawl (or vice versa). A read_only connection only
+    updates the structure (through a separate connection) if a table is missing or has not been migrated, and reads a
+    single consistent snapshot for as long as it is open."""
+
+    def __init__(self, read_only=False):
         MetroDB.__init__(self, 'pa_legislature', enums_to_register=[
             Chamber,
             Vote,
-        ])
+        ], uri_query='mode=ro' if read_only else None)
+        self.read_only = read_only
+        self.unique_keys = {}
+        self.without_rowid = set()
+        self.indexes = {}
+        self.lock_wait_seconds = 0.0
+
+        self.execute(f'PRAGMA busy_timeout = {int(LOCK_REPORT_SECONDS * 1000)}')
+        self.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KB}')
+        self.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+        if not read_only:
+            self.execute('PRAGMA journal_mode = WAL')
+            self.execute('PRAGMA synchronous = NORMAL')
+
+    def __enter__(self):
+        if not self.read_only:
+            return MetroDB.__enter__(self)
+
+        self.load_yaml()
+        for table, keys in self.tables.items():
+            for key in keys:
+                if key in self.primary_keys:
+                    self.primary_key_per_table[table] = key
+
+        # A file last written by an older version has to be migrated before it can be read with the current tables
+        if self.needs_structure_update():
+            click.secho('Updating the database structure before reading it...', fg='bright_black')
+            writer = PALegislatureDB()
+            writer.update_database_structure()
+            writer.close(print_table_sizes=False)
+
+        # Held until close()
+        self.execute('BEGIN')
+        return self
+
+    def needs_structure_update(self):
+        """Whether any table is missing, or the votes still have the voter names (see migrate_vote_names)"""
+        if 'name' in self.get_sql_table_types('votes'):
+            return True
+        return any(not self.get_sql_table_types(table) for table in self.tables)
+
+    def wait_for_lock(self, method, *args):
+        """Call method, retrying while another connection holds the lock and reporting how long that took"""
+        start = None
+        while True:
+            try:
+                result = method(*args)
+                break
+            except sqlite3.Error as e:
+                if 'database is locked' not in str(e):
+                    raise
+                now = time.perf_counter()
+                if start is None:
+                    start = now - LOCK_REPORT_SECONDS
+                    click.secho('Waiting for another process to release the database lock...', fg='yellow')
+                elif now - start > LOCK_TIMEOUT_SECONDS:
+                    raise
+
+        if start is not None:
+            waited = time.perf_counter() - start
+            self.lock_wait_seconds += waited
+            click.secho(f'Got the database lock after {waited:.1f}s', fg='yellow')
+        return result
+
+    def execute(self, command, params=()):
+        return self.wait_for_lock(MetroDB.execute, self, command, params)
+
+    def execute_many(self, command, objects):
+        return self.wait_for_lock(MetroDB.execute_many, self, command, objects)
+
+    def write(self):
+        self.wait_for_lock(self.raw_db.commit)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Apply all of the writes in the block or none of them.
+
+        If no transaction is open, the writes are committed at the end of the block. Otherwise they are grouped in
+        a savepoint, and committing is left to whoever opened the transaction."""
+        if not self.raw_db.in_transaction:
+            with self.raw_db:
+                yield
+            return
+
+        self.execute('SAVEPOINT batch')
+        try:
+            yield
+        except BaseException:
+            self.end_savepoint('ROLLBACK TO batch')
+            self.end_savepoint('RELEASE batch')
+            raise
+        self.end_savepoint('RELEASE batch')
+
+    def end_savepoint(self, command):
+        """Run the ROLLBACK TO or RELEASE command, unless the savepoint is already gone (i.e. it was committed)"""
+        try:
+            self.execute(command)
+        except sqlite3.OperationalError as e:
+            if 'no such savepoint' not in str(e):
+                raise
+
+    def load_yaml(self, structure_filepath=None, structure_key=None):
+        MetroDB.load_yaml(self, structure_filepath, structure_key)
+        if structure_filepath is None:
+            structure_filepath = self.folder / f'{structure_key or self.key}.yaml'
+        db_structure = yaml.safe_load(open(structure_filepath))
+        self.unique_keys = db_structure.get('unique_keys', {})
+        self.without_rowid = set(db_structure.get('without_rowid', []))
+        self.indexes = db_structure.get('indexes', {})
+
+    def get_create_table_command(self, table, keys):
+        types = []
+        for key in keys:
+            tt = self.get_field_type(key, full=True)
+            types.append(f'{key} {tt}')
+        if table in self.unique_keys:
+            constraint = 'PRIMARY KEY' if table in self.without_rowid else 'UNIQUE'
+            types.append(f'{constraint} ({", ".join(self.unique_keys[table])})')
+        type_s = ', '.join(types)
+        suffix = ' WITHOUT ROWID' if table in self.without_rowid else ''
+        return f'CREATE TABLE {table} ({type_s}){suffix}'
+
+    def create_table(self, table, keys):
+        self.execute(self.get_create_table_command(table, keys))
+
+    def rebuild_table(self, table, keys):
+        """Recreate the table with its current layout and keys, dropping any rows that duplicate a unique key"""
+        temp_table_name = f'{table}_x'
+        fields_s = ', '.join(keys)
+        self.execute(f'ALTER TABLE {table} RENAME TO {temp_table_name}')
+        self.create_table(table, keys)
+        self.execute(f'INSERT OR IGNORE INTO {table}({fields_s}) SELECT {fields_s} FROM {temp_table_name}')
+        dropped = self.count(temp_table_name) - self.count(table)
+        self.execute(f'DROP TABLE {temp_table_name}')
+        if dropped:
+            click.secho(f'Dropped {dropped} duplicate rows from {table}', fg='yellow')
 
-    def get_crawl_statuses(self, rolls=None):
-        day_total = collections.Counter()
-        day_crawled = collections.Counter()
-        session_id_to_key = {}
+    def update_indexes(self):
+        """Create the indexes in the yaml, and drop any others. Returns whether anything changed"""
+        commands = {}
+        for table, index_list in self.indexes.items():
+            for fields in index_list:
+                name = f'{table}_{"_".join(fields)}'
+                commands[name] = f'CREATE INDEX {name} ON {table} ({", ".join(fields)})'
 
-        days = {d['id']: d for d in self.query('SELECT * FROM session_days')}
+        changed = False
+        existing = {}
+        for row in self.query("SELECT name, sql FROM sqlite_master WHERE type='index' AND sql IS NOT NULL"):
+            existing[row['name']] = row['sql']
+        for name, command in existing.items():
+            if commands.get(name) != command:
+                self.execute(f'DROP INDEX {name}')
+                changed = True
+        for name, command in commands.items():
+            if existing.get(name) != command:
+                self.execute(command)
+                changed = True
+        return changed
 
-        for session in self.query('SELECT year, chamber, id FROM sessions ORDER BY year'):
-            key = session['year'], session['chamber']
-            sid = session['id']
-            session_id_to_key[sid] = key
+    def update_triggers(self):
+        """Create the triggers that maintain crawl_status, packed_rolls and export_versions, replacing any that differ.
 
-        for day in days.values():
-            key = session_id_to_key[day['session_id']]
-            day_total[key] += 1
-            if day['last_crawl']:
-                day_crawled[key] += 1
+        Returns whether anything changed"""
+        commands = get_triggers()
+        changed = False
+        existing = {}
+        for row in self.query("SELECT name, sql FROM sqlite_master WHERE type='trigger'"):
+            existing[row['name']] = row['sql']
+        for name, command in existing.items():
+            if commands.get(name) != command:
+                self.execute(f'DROP TRIGGER {name}')
+                changed = True
+        for name, command in commands.items():
+            if existing.get(name) != command:
+                self.execute(command)
+                changed = True
+        return changed
 
-        roll_total = collections.Counter()
-        roll_crawled = collections.Counter()
+    def rebuild_crawl_status(self):
+        self.execute('DELETE FROM crawl_status')
+        self.execute(f'INSERT INTO crawl_status ({STATUS_FIELDS}) {STATUS_QUERY}')
+
+    def migrate_vote_names(self):
+        """Move the voter names (and their member_ids) from votes to vote_names, if votes still has them.
+
+        Returns whether anything changed"""
+        if 'name' not in self.get_sql_table_types('votes'):
+            return False
+
+        click.secho('Moving the voter names from votes to vote_names...', fg='bright_black')
+        if not self.get_sql_table_types('vote_names'):
+            self.create_table('vote_names', self.tables['vote_names'])
+        self.execute('INSERT OR IGNORE INTO vote_names (session_id, name, member_id) '
+                     'SELECT session_id, name, MAX(member_id) FROM votes GROUP BY session_id, name')
+        self.execute('ALTER TABLE votes RENAME TO votes_x')
+        self.create_table('votes', self.tables['votes'])
+        self.execute('INSERT OR IGNORE INTO votes (roll_id, name_id, vote) '
+                     'SELECT votes_x.roll_id, vote_names.id, votes_x.vote FROM votes_x JOIN vote_names '
+                     'ON vote_names.session_id = votes_x.session_id AND vote_names.name = votes_x.name')
+        self.execute('DROP TABLE votes_x')
+
+        # The rosters of packed_votes.py held names instead of name_ids, so they have to be rebuilt
+        self.execute('DROP TABLE IF EXISTS rosters')
+        self.execute('DROP TABLE IF EXISTS packed_rolls')
+        return True
+
+    def update_database_structure(self):
+        """Create or update the columns of each table, then its keys, layout, indexes and triggers"""
+        if not self.tables:
+            self.load_yaml()
+
+        # Tables are restructured by renaming them, which should not rewrite (and break) the trigger bodies
+        self.execute('PRAGMA legacy_alter_table = ON')
+        changed = self.migrate_vote_names()
+        MetroDB.update_database_structure(self)
+        for table, keys in self.tables.items():
+            command = self.lookup('sql', 'sqlite_master', {'type': 'table', 'name': table})
+            if command != self.get_create_table_command(table, keys):
+                self.rebuild_table(table, keys)
+                changed = True
+
+        self.execute('PRAGMA legacy_alter_table = OFF')
+
+        # Without the triggers, the derived tables may have missed changes
+        if self.update_triggers():
+            self.rebuild_crawl_status()
+            self.execute('DELETE FROM packed_rolls')
+            self.execute(EXPORT_UPSERT.format(select='SELECT DISTINCT year, chamber, 1 FROM sessions WHERE true'))
+            changed = True
+
+        if self.update_indexes() or changed:
+            self.execute('ANALYZE')
+            self.write()
+
+    def build_clause(self, clause_spec, operator='AND', table=None):
+        """Return the WHERE clause for the clause_spec with placeholders, and the values for them.
+
+        clause_spec is a dict of field names to values (None becomes IS NULL and lists/tuples/sets become IN),
+        the value of the table's primary key, or a string, which is used as is."""
+        if not clause_spec:
+            return '', []
+        if isinstance(clause_spec, str):
+            return clause_spec, []
+        if not isinstance(clause_spec, dict):
+            if table not in self.primary_key_per_table:
+                raise DatabaseError(f'Table {table} does not have a defined primary key',
+                                    f'build_clause({clause_spec})')
+            clause_spec = {self.primary_key_per_table[table]: clause_spec}
+
+        pieces = []
+        params = []
+        for key, value in clause_spec.items():
+            if value is None:
+                pieces.append(f'{key} IS NULL')
+            elif isinstance(value, (list, tuple, set)):
+                pieces.append(f'{key} IN ({", ".join("?" * len(value))})')
+                params += value
+            else:
+                pieces.append(f'{key}=?')
+                params.append(value)
+        return 'WHERE ' + f' {operator} '.join(pieces), params
+
+    def build_select(self, table, fields=[], clause='', order=[], grouping=[], params=()):
+        """Return a SELECT statement and its parameters (see build_clause)"""
+        clause, clause_params = self.build_clause(clause, table=table)
+        if not fields:
+            fields = '*'
+        query = f'SELECT {fields if isinstance(fields, str) else ", ".join(fields)} FROM {table} {clause}'
+        if grouping:
+            query += f' GROUP BY {grouping if isinstance(grouping, str) else ", ".join(grouping)}'
+        if order:
+            query += f' ORDER BY {order if isinstance(order, str) else ", ".join(order)}'
+        return query, list(params) + clause_params
+
+    def query(self, query, params=()):
+        return FlexibleIterator(self.execute(query, params))
+
+    def query_one(self, query, params=()):
+        return self.execute(query, params).fetchone()
+
+    def select(self, table, fields=[], clause='', order=[], grouping=[], params=()):
+        return self.query(*self.build_select(table, fields, clause, order, grouping, params))
+
+    def select_one(self, table, fields=[], clause='', order=[], grouping=[], params=()):
+        return self.query_one(*self.build_select(table, fields, clause, order, grouping, params))
+
+    def lookup_all(self, field, table, clause='', distinct=False, params=()):
+        field_s = field if not distinct else f'DISTINCT {field}'
+        return FlexibleIterator(row[0] for row in self.select(table, [field_s], clause, params=params))
+
+    def lookup(self, field, table, clause='', params=()):
+        row = self.select_one(table, [field], clause, params=params)
+        if row:
+            return row[0]
+
+    def count(self, table, clause='', params=()):
+        return self.lookup('COUNT(*)', table, clause, params)
+
+    def dict_lookup(self, key_field, value_field, table, clause='', params=()):
+        rows = self.select(table, [key_field, value_field], clause, params=params)
+        return {row[key_field]: row[value_field] for row in rows}
+
+    def update(self, table, row_dict, replace_key='id'):
+        """Update the row whose replace_key field(s) match the row_dict's values, or insert it if there is none"""
+        keys = [replace_key] if isinstance(replace_key, str) else list(replace_key)
+        clause, params = self.build_clause({key: row_dict[key] for key in keys})
+        existing = self.select_one(table, clause=clause, params=params)
+        if not existing:
+            self.insert(table, row_dict)
+            existing = self.select_one(table, clause=clause, params=params)
+        else:
+            fields = [key for key in row_dict if key not in keys]
+            if fields:
+                field_s = ', '.join(f'{key}=?' for key in fields)
+                self.execute(f'UPDATE {table} SET {field_s} {clause}', [row_dict[key] for key in fields] + params)
+
+        return_key = self.primary_key_per_table.get(table)
+        if return_key is None:
+            return
+        return row_dict[return_key] if return_key in row_dict else existing[return_key]
+
+    def delete(self, table, clause='', params=()):
+        clause, clause_params = self.build_clause(clause, table=table)
+        self.execute(f'DELETE FROM {table} {clause}', list(params) + clause_params)
+
+    def get_crawl_counts(self):
+        """Return (table, total rows, crawled rows) for each of the crawled tables, with a single query.
+
+        The counts of days and rolls come from crawl_status, so they do not depend on the size of the database."""
+        parts = []
+        for table in ['sessions', 'member_crawl', 'members']:
+            parts.append(f"SELECT '{table}', COUNT(*), COUNT(last_crawl) FROM {table}")
+        for table, prefix in [('session_days', 'day'), ('roll_calls', 'roll')]:
+            parts.append(f"SELECT '{table}', COALESCE(SUM({prefix}_total), 0), COALESCE(SUM({prefix}_crawled), 0) "
+                         'FROM crawl_status')
+        order = ['sessions', 'session_days', 'roll_calls', 'member_crawl', 'members']
+        counts = {row[0]: (row[1], row[2]) for row in self.execute(' UNION ALL '.join(parts))}
+        return [(table,) + counts[table] for table in order]
+
+    def get_name_ids(self, session_id, names):
+        """Map each of the names to its id in vote_names for the session, adding the names that are new"""
+        name_ids = self.dict_lookup('name', 'id', 'vote_names', {'session_id': session_id})
+        for name in names:
+            if name not in name_ids:
+                name_ids[name] = self.insert('vote_names', {'session_id': session_id, 'name': name})
+        return name_ids
+
+    def update_votes(self, session_id, roll_id, votes, delete_missing=False):
+        """Insert or update all of the (name, vote) pairs for one roll in a single transaction.
+
+        If delete_missing, votes by names that are not in votes are removed."""
+        name_ids = self.get_name_ids(session_id, [name for name, vote in votes])
+        existing = self.dict_lookup('name_id', 'vote', 'votes', {'roll_id': roll_id})
+        inserts = []
+        updates = []
+        for name, vote in votes:
+            name_id = name_ids[name]
+            if name_id not in existing:
+                inserts.append((roll_id, name_id, vote))
+            elif existing[name_id] != vote:
+                updates.append((vote, roll_id, name_id))
+            existing[name_id] = vote
+
+        with self.transaction():
+            self.execute_many('INSERT INTO votes (roll_id, name_id, vote) VALUES(?, ?, ?)', inserts)
+            self.execute_many('UPDATE votes SET vote=? WHERE roll_id=? AND name_id=?', updates)
+            if delete_missing:
+                kept = {name_ids[name] for name, vote in votes}
+                self.execute_many('DELETE FROM votes WHERE roll_id=? AND name_id=?',
+                                  [(roll_id, name_id) for name_id in existing if name_id not in kept])
+
+    def rename_vote_name(self, before, after, roll_ids=None):
+        """Rename a voter name in every session, or only in the votes of the given rolls.
+
+        Renaming it everywhere only updates one vote_names row per session, unless the session already has a voter
+        with the new name, in which case the votes are moved to that name. Votes on rolls where the new name also
+        voted are left with the old name. Returns the ids of those rolls"""
+        collisions = []
+        for row in list(self.select('vote_names', ['id', 'session_id'], {'name': before})):
+            new_id = self.lookup('id', 'vote_names', {'session_id': row['session_id'], 'name': after})
+            if roll_ids is None and new_id is None:
+                self.execute('UPDATE vote_names SET name=? WHERE id=?', [after, row['id']])
+                continue
+
+            if new_id is None:
+                new_id = self.insert('vote_names', {'session_id': row['session_id'], 'name': after})
+            clause = {'name_id': row['id']}
+            if roll_ids is not None:
+                clause['roll_id'] = roll_ids
+            clause, params = self.build_clause(clause)
+            collision_clause = f'{clause} AND roll_id IN (SELECT roll_id FROM votes WHERE name_id=?)'
+            collisions += self.lookup_all('roll_id', 'votes', collision_clause, params=params + [new_id])
+            self.execute(f'UPDATE votes SET name_id=? {clause} AND roll_id NOT IN '
+                         '(SELECT roll_id FROM votes WHERE name_id=?)', [new_id] + params + [new_id])
+            if roll_ids is None and not self.count('votes', {'name_id': row['id']}):
+                self.delete('vote_names', {'id': row['id']})
+        return collisions
+
+    def update_service(self, rows):
+        """Insert or update service rows (keyed by member_id, year and chamber) in a single transaction"""
+        member_ids = {row['member_id'] for row in rows}
+        if not member_ids:
+            return
+        existing = set()
+        for row in self.select('service', ['member_id', 'year', 'chamber'], {'member_id': member_ids}):
+            existing.add((row['member_id'], row['year'], row['chamber']))
+
+        inserts = []
+        updates = []
+        for row in rows:
+            key = row['member_id'], row['year'], row['chamber']
+            if key in existing:
+                updates.append((row['district'], row['party']) + key)
+            else:
+                inserts.append(key + (row['district'], row['party']))
+                existing.add(key)
 
-        if rolls is None:
-            rolls = {d['id']: d for d in self.query('SELECT * FROM roll_calls')}
+        with self.transaction():
+            self.execute_many('INSERT INTO service (member_id, year, chamber, district, party) '
+                              'VALUES(?, ?, ?, ?, ?)', inserts)
+            self.execute_many('UPDATE service SET district=?, party=? WHERE member_id=? AND year=? AND chamber=?',
+                              updates)
 
-        for roll in rolls.values():
-            day = days[roll['day_id']]
-            key = session_id_to_key[day['session_id']]
-            roll_total[key] += 1
-            if roll['last_crawl']:
-                roll_crawled[key] += 1
+    def get_export_versions(self):
+        """Map each (year, chamber) to a number that changes whenever the data of its vote_data file changes"""
+        return {(row['year'], row['chamber']): row['version'] for row in self.query('SELECT * FROM export_versions')}
 
+    def get_crawl_statuses(self):
+        """Map each (year, chamber) with session days to complete, days missing, rolls missing or None (no rolls)"""
         statuses = {}
-        for key in day_total:
-            if day_total[key] == 0 or roll_total[key] == 0:
+        for row in self.query('SELECT * FROM crawl_status WHERE day_total > 0'):
+            key = row['year'], row['chamber']
+            if row['roll_total'] == 0:
                 statuses[key] = None
-            elif day_total[key] == day_crawled[key]:
-                if roll_total[key] == roll_crawled[key]:
+            elif row['day_total'] == row['day_crawled']:
+                if row['roll_total'] == row['roll_crawled']:
                     statuses[key] = 'complete'
                 else:
                     statuses[key] = 'rolls missing'
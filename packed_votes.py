@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+"""Compact copy of the votes table: the votes of each roll packed into one blob, three bits per vote.
+
+Each session has a roster, an ordered list of the vote_names that voted in it. Names are only ever appended, so the
+position of a name never changes and a packed roll stays valid as the roster grows. Position i of a roll's blob is the
+vote of roster name i, or NO_RECORD. Names added after the roll was packed (position >= roster_size) have NO_RECORD as
+well. Since the roster holds name_ids, renaming a vote_name does not change any packed roll.
+
+The votes table is still the source of truth. Its triggers (see pa_legislature.py) discard the packed copy of a roll
+whenever its votes change, and pack_rolls packs whatever is missing.
+"""
+import argparse
+import click
+from tqdm import tqdm
+
+from pa_legislature import PALegislatureDB, Vote, NAMED_VOTES
+
+BITS_PER_VOTE = 3
+VOTE_MASK = (1 << BITS_PER_VOTE) - 1
+NO_RECORD = 0  # The Vote values start at 1
+
+UNPACKED_ROLLS_QUERY = 'SELECT roll_calls.id AS roll_id, session_days.session_id FROM roll_calls ' \
+                       'JOIN session_days ON roll_calls.day_id = session_days.id ' \
+                       'LEFT JOIN packed_rolls ON packed_rolls.roll_id = roll_calls.id ' \
+                       'WHERE roll_calls.last_crawl IS NOT NULL AND packed_rolls.roll_id IS NULL ' \
+                       'ORDER BY session_days.session_id, roll_calls.id'
+
+# A LEFT JOIN, so that names deleted by rename_vote_name still take up their position
+ROSTER_QUERY = 'SELECT rosters.name_id, vote_names.name FROM rosters ' \
+               'LEFT JOIN vote_names ON rosters.name_id = vote_names.id ' \
+               'WHERE rosters.session_id=? ORDER BY rosters.position'
+ROSTERED_NAMES = 'rosters JOIN vote_names ON rosters.name_id = vote_names.id'
+
+
+def pack(codes):
+    """Pack a sequence of small ints (0-7) into little-endian bytes"""
+    value = 0
+    for i, code in enumerate(codes):
+        value |= code << (BITS_PER_VOTE * i)
+    return value.to_bytes((BITS_PER_VOTE * len(codes) + 7) // 8, 'little')
+
+
+def unpack(packed, size, out=None):
+    """Return the size codes in packed as a bytearray (or append them to out)"""
+    value = int.from_bytes(packed, 'little')
+    if out is None:
+        out = bytearray()
+    for i in range(size):
+        out.append(value & VOTE_MASK)
+        value >>= BITS_PER_VOTE
+    return out
+
+
+def get_code(packed, size, position):
+    """Return a single code from packed, without unpacking the rest"""
+    if position >= size:
+        return NO_RECORD
+    bit = BITS_PER_VOTE * position
+    byte = bit // 8
+    return (int.from_bytes(packed[byte:byte + 2], 'little') >> (bit % 8)) & VOTE_MASK
+
+
+def get_roster(db, session_id):
+    """Return the (name_id, name) pairs of the session's roster, in order"""
+    return [tuple(row) for row in db.execute(ROSTER_QUERY, [session_id])]
+
+
+def pack_session(db, session_id, roll_ids):
+    """Pack the given rolls of one session, appending any new names to its roster"""
+    positions = {name_id: i for i, (name_id, name) in enumerate(get_roster(db, session_id))}
+    new_names = []
+    packed_rows = []
+    for roll_id in roll_ids:
+        votes = list(db.execute('SELECT name_id, vote FROM votes WHERE roll_id=? ORDER BY name_id', [roll_id]))
+        for name_id, vote in votes:
+            if name_id not in positions:
+                positions[name_id] = len(positions)
+                new_names.append((session_id, positions[name_id], name_id))
+        codes = [NO_RECORD] * len(positions)
+        for name_id, vote in votes:
+            codes[positions[name_id]] = int(vote)
+        packed_rows.append((roll_id, session_id, len(positions), pack(codes)))
+
+    with db.raw_db:
+        db.execute_many('INSERT INTO rosters (session_id, position, name_id) VALUES(?, ?, ?)', new_names)
+        db.execute_many('INSERT OR REPLACE INTO packed_rolls (roll_id, session_id, roster_size, packed) '
+                        'VALUES(?, ?, ?, ?)', packed_rows)
+
+
+def pack_rolls(db, progress=False):
+    """Pack every crawled roll that does not have an up-to-date packed copy. Returns the number of rolls packed"""
+    by_session = {}
+    for row in db.execute(UNPACKED_ROLLS_QUERY):
+        by_session.setdefault(row['session_id'], []).append(row['roll_id'])
+
+    total = sum(len(roll_ids) for roll_ids in by_session.values())
+    with tqdm(total=total, desc='Packing rolls', disable=not progress) as bar:
+        for session_id, roll_ids in by_session.items():
+            pack_session(db, session_id, roll_ids)
+            bar.update(len(roll_ids))
+    return total
+
+
+def read_session(db, session_id):
+    """Return the roster names, the packed roll_ids and the codes of the session as one row-major bytearray.
+
+    The bytearray has one byte per (roll, roster name), so it can be wrapped without copying, e.g. with
+    numpy.frombuffer(codes, dtype=numpy.int8).reshape(len(roll_ids), len(roster))"""
+    roster = [name for name_id, name in get_roster(db, session_id)]
+    roll_ids = []
+    codes = bytearray()
+    for roll_id, size, packed in db.execute('SELECT roll_id, roster_size, packed FROM packed_rolls '
+                                            'WHERE session_id=? ORDER BY roll_id', [session_id]):
+        roll_ids.append(roll_id)
+        unpack(packed, size, codes)
+        codes.extend(bytes(len(roster) - size))
+    return roster, roll_ids, codes
+
+
+def get_roll_votes(db, roll_id):
+    """Return the (name, Vote) pairs of one roll sorted by name, from the packed copy if there is one"""
+    row = db.execute('SELECT session_id, roster_size, packed FROM packed_rolls WHERE roll_id=?', [roll_id]).fetchone()
+    if row is None:
+        return [tuple(row) for row in db.select(NAMED_VOTES, ['name', 'vote'], {'roll_id': roll_id}, order='name')]
+    session_id, size, packed = row
+    roster = get_roster(db, session_id)
+    return sorted((name, Vote(code)) for (name_id, name), code in zip(roster, unpack(packed, size))
+                  if code != NO_RECORD)
+
+
+def get_member_votes(db, session_id, name):
+    """Return the (roll_id, Vote) pairs for one name in one session, reading one code from each packed roll"""
+    position = db.lookup('position', ROSTERED_NAMES, {'rosters.session_id': session_id, 'name': name})
+    results = []
+    if position is not None:
+        for roll_id, size, packed in db.execute('SELECT roll_id, roster_size, packed FROM packed_rolls '
+                                                'WHERE session_id=?', [session_id]):
+            code = get_code(packed, size, position)
+            if code != NO_RECORD:
+                results.append((roll_id, Vote(code)))
+
+    # Rolls without a packed copy
+    results += [(roll_id, vote) for roll_id, vote in db.execute(
+        f'SELECT votes.roll_id, vote FROM {NAMED_VOTES} LEFT JOIN packed_rolls ON packed_rolls.roll_id = votes.roll_id '
+        'WHERE name=? AND vote_names.session_id=? AND packed_rolls.roll_id IS NULL', [name, session_id])]
+    return sorted(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pack the votes of each roll into the packed_rolls table')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Discard the rosters and packed rolls first (drops names that no longer have votes)')
+    args = parser.parse_args()
+
+    with PALegislatureDB() as db:
+        if args.rebuild:
+            with db.raw_db:
+                db.execute('DELETE FROM packed_rolls')
+                db.execute('DELETE FROM rosters')
+        n = pack_rolls(db, progress=True)
+        rolls, total_bytes = db.execute('SELECT COUNT(*), COALESCE(SUM(LENGTH(packed)), 0) '
+                                        'FROM packed_rolls').fetchone()
+        click.secho(f'Packed {n} rolls. {rolls} rolls are packed, in {total_bytes / 1024:.1f} KB', fg='bright_white')
@@ -0,0 +1,111 @@
+import gzip
+import hashlib
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+
+CACHE_FOLDER = pathlib.Path('.cached_html')
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+
+class PageCache:
+    """Gzipped pages keyed by their full URL, with an index of size, fetch time and validators for each.
+
+    Entries younger than ttl seconds are served without touching the network. Older entries are revalidated
+    with If-None-Match / If-Modified-Since. When the total size exceeds max_bytes, the least recently used
+    entries are evicted."""
+
+    def __init__(self, folder=CACHE_FOLDER, ttl=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.folder = pathlib.Path(folder)
+        self.folder.mkdir(exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+        self.index = sqlite3.connect(self.folder / 'index.db', check_same_thread=False, isolation_level=None,
+                                     timeout=30)
+        self.index.row_factory = sqlite3.Row
+        self.index.execute('CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, filename TEXT, size INTEGER, '
+                           'fetched REAL, accessed REAL, etag TEXT, last_modified TEXT)')
+        self.index.execute('CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed)')
+        self.total_size = self.index.execute('SELECT COALESCE(SUM(size), 0) FROM pages').fetchone()[0]
+
+    def get_path(self, url):
+        digest = hashlib.sha1(url.encode()).hexdigest()
+        return self.folder / digest[:2] / (digest[2:] + '.html.gz')
+
+    def lookup(self, url):
+        with self.lock:
+            return self.index.execute('SELECT * FROM pages WHERE url=?', (url,)).fetchone()
+
+    def is_fresh(self, entry):
+        return self.ttl is not None and time.time() - entry['fetched'] < self.ttl
+
+    def get_validators(self, entry):
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def read(self, entry):
+        """Return the cached contents, or None if the file has gone missing"""
+        path = self.folder / entry['filename']
+        try:
+            contents = gzip.decompress(path.read_bytes()).decode()
+        except FileNotFoundError:
+            return
+        with self.lock:
+            self.index.execute('UPDATE pages SET accessed=? WHERE url=?', (time.time(), entry['url']))
+        return contents
+
+    def read_url(self, url):
+        """Return the cached contents of url without using the index (so it can be called from other processes),
+        or None if the page is not cached"""
+        try:
+            return gzip.decompress(self.get_path(url).read_bytes()).decode()
+        except FileNotFoundError:
+            return
+
+    def touch(self, entry):
+        """Mark an entry as just fetched, i.e. after the server says it has not been modified"""
+        now = time.time()
+        with self.lock:
+            self.index.execute('UPDATE pages SET fetched=?, accessed=? WHERE url=?', (now, now, entry['url']))
+
+    def store(self, url, contents, headers):
+        path = self.get_path(url)
+        path.parent.mkdir(exist_ok=True)
+        data = gzip.compress(contents.encode())
+
+        # Write then rename so that readers never see a partial file
+        temp_path = path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}')
+        temp_path.write_bytes(data)
+        os.replace(temp_path, path)
+
+        now = time.time()
+        with self.lock:
+            old_size = self.index.execute('SELECT size FROM pages WHERE url=?', (url,)).fetchone()
+            self.index.execute('INSERT OR REPLACE INTO pages VALUES(?, ?, ?, ?, ?, ?, ?)',
+                               (url, str(path.relative_to(self.folder)), len(data), now, now,
+                                headers.get('ETag'), headers.get('Last-Modified')))
+            self.total_size += len(data) - (old_size[0] if old_size else 0)
+            if self.max_bytes is not None and self.total_size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes. Assumes the lock is held"""
+        rows = self.index.execute('SELECT url, filename, size FROM pages ORDER BY accessed')
+        to_remove = []
+        for row in rows:
+            if self.total_size <= self.max_bytes:
+                break
+            to_remove.append(row)
+            self.total_size -= row['size']
+
+        for row in to_remove:
+            self.index.execute('DELETE FROM pages WHERE url=?', (row['url'],))
+            (self.folder / row['filename']).unlink(missing_ok=True)
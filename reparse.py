@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+import argparse
+import click
+import collections
+import concurrent.futures
+import os
+from tqdm import tqdm
+
+import crawl
+from pa_legislature import PALegislatureDB
+from page_cache import PageCache, CACHE_FOLDER
+
+KINDS = ['day', 'roll', 'member_list', 'bio']
+
+# Only items that were crawled have pages in the cache
+ITEM_QUERIES = {
+    'day': 'SELECT * FROM session_days WHERE last_crawl IS NOT NULL ORDER BY date',
+    'roll': 'SELECT roll_calls.*, session_days.session_id FROM roll_calls '
+            'LEFT JOIN session_days ON roll_calls.day_id = session_days.id WHERE roll_calls.last_crawl IS NOT NULL '
+            'ORDER BY roll_calls.id',
+    'member_list': 'SELECT * FROM member_crawl WHERE last_crawl IS NOT NULL ORDER BY name',
+    'bio': 'SELECT * FROM members WHERE last_crawl IS NOT NULL ORDER BY id',
+}
+
+FETCH_METHODS = {
+    'day': crawl.fetch_day,
+    'roll': crawl.fetch_roll,
+    'member_list': crawl.fetch_member_list,
+    'bio': crawl.fetch_member,
+}
+
+
+class MissingPage(Exception):
+    pass
+
+
+class CachedPages:
+    """Stands in for crawl.FETCHER, serving pages from the page cache and never from the network.
+
+    Redirects are not cached, so the member lists can only be reparsed if their bio links were already resolved."""
+
+    def __init__(self, folder):
+        self.cache = PageCache(folder, max_bytes=None)
+
+    def get_text(self, url):
+        contents = self.cache.read_url(url)
+        if contents is None:
+            raise MissingPage(url)
+        return contents
+
+    def head(self, url):
+        raise MissingPage(url)
+
+
+def init_worker(folder, parser):
+    crawl.FETCHER = CachedPages(folder)
+    crawl.PARSER = parser
+
+
+def reparse(task):
+    """Run the crawl's fetch method for the item, using the cached pages. Returns None if a page is not cached"""
+    kind, fetch_arg = task
+    try:
+        return FETCH_METHODS[kind](fetch_arg)
+    except MissingPage:
+        return
+
+
+def get_fetch_arg(db, kind, item, member_list_work):
+    if kind == 'day':
+        return crawl.get_day_request(db, item)
+    elif kind == 'member_list':
+        return item['name'], member_list_work[item['name']]
+    return item
+
+
+def rewrite_day(db, day, fetch_arg, fetched):
+    chamber, full_url, floor_url, rolls = fetched
+    for roll_d in rolls or []:
+        roll_d = dict(roll_d, day_id=day['id'])
+        db.update('roll_calls', roll_d, ['chamber', 'session_year', 'session_index', 'number'])
+
+
+def rewrite_roll(db, roll, fetch_arg, fetched):
+    full_url, (votes, stamp) = fetched
+    db.update_votes(roll['session_id'], roll['id'], votes, delete_missing=True)
+    if stamp != roll['stamp']:
+        db.update('roll_calls', {'id': roll['id'], 'stamp': stamp})
+
+
+def rewrite_member_list(db, member_list, fetch_arg, fetched):
+    crawl_name, (fetch_method, fetch_args, write_method, write_args) = fetch_arg
+    write_method(db, *write_args, fetched)
+
+
+def rewrite_bio(db, member, fetch_arg, fetched):
+    request, err, bio = fetched
+    if err:
+        return
+    name_dict, dob, services, terms = bio
+    if not crawl.assert_names_equal(member, name_dict):
+        return
+    db.update_service([dict(row, member_id=member['id']) for row in services])
+    db.update('members', {'id': member['id'], 'dob': dob})
+
+
+REWRITE_METHODS = {
+    'day': rewrite_day,
+    'roll': rewrite_roll,
+    'member_list': rewrite_member_list,
+    'bio': rewrite_bio,
+}
+
+
+def rewrite(db, kind, item, fetch_arg, fetched):
+    """Write the reparsed item, undoing its changes if it needs a page that is not cached (i.e. an unresolved bio
+    link of a member list). Returns whether it was written"""
+    try:
+        with db.transaction():
+            REWRITE_METHODS[kind](db, item, fetch_arg, fetched)
+    except MissingPage:
+        return False
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild the crawled data from the page cache, without the network')
+    parser.add_argument('-k', '--kind', dest='kinds', action='append', choices=KINDS,
+                        help='What to reparse: day pages (roll_calls), roll pages (votes and stamps), member lists '
+                             '(members and service) or bios (service and dob). Can be repeated. Defaults to all')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help='Number of processes for parsing')
+    parser.add_argument('--cache-folder', default=CACHE_FOLDER)
+    parser.add_argument('--parser', choices=['html.parser', 'lxml'], default='html.parser')
+    args = parser.parse_args()
+
+    # The writers of the member lists may look up redirects
+    init_worker(args.cache_folder, args.parser)
+
+    with PALegislatureDB() as db, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker,
+                                                   initargs=(args.cache_folder, args.parser)) as executor:
+        member_list_work = crawl.get_member_list_work(db)
+        for kind in KINDS:
+            if args.kinds and kind not in args.kinds:
+                continue
+            items = [dict(item) for item in db.query(ITEM_QUERIES[kind])]
+            tasks = [(kind, get_fetch_arg(db, kind, item, member_list_work)) for item in items]
+            chunk_size = max(1, min(64, len(tasks) // (4 * args.workers)))
+
+            counts = collections.Counter()
+            results = executor.map(reparse, tasks, chunksize=chunk_size)
+            for item, (_, fetch_arg), fetched in tqdm(zip(items, tasks, results), total=len(items),
+                                                      desc=f'Reparsing {kind}s'):
+                if fetched is None or not rewrite(db, kind, item, fetch_arg, fetched):
+                    counts['missing'] += 1
+                    continue
+                counts['reparsed'] += 1
+            db.write()
+
+            click.secho(f'{kind:4s} {counts["reparsed"]:6d} reparsed', fg='bright_white', nl=False)
+            if counts['missing']:
+                click.secho(f' ({counts["missing"]} not in the cache)', fg='yellow')
+            else:
+                click.secho('')
@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+import argparse
+import click
+import gzip
+import http.server
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+
+class ReplayArchive:
+    """Every page (and redirect) fetched by a crawl, keyed by method and full URL"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS pages (method TEXT, url TEXT, status INTEGER, location TEXT, '
+                        'body BLOB, PRIMARY KEY(method, url))')
+
+    def record(self, method, url, status, location=None, contents=''):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO pages VALUES(?, ?, ?, ?, ?)',
+                            (method, url, status, location, gzip.compress(contents.encode())))
+            self.db.commit()
+
+    def lookup(self, method, url):
+        """Return (status, location, body bytes) or None"""
+        with self.lock:
+            row = self.db.execute('SELECT status, location, body FROM pages WHERE method=? AND url=?',
+                                  (method, url)).fetchone()
+        if row:
+            status, location, body = row
+            return status, location, gzip.decompress(body)
+
+    def count(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+
+class ReplayHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the archive with the same paths as the real sites.
+
+    The original host is taken from the Host header, which Fetcher sets when replay_url is used."""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def respond(self, method):
+        url = f'https://{self.headers["Host"]}{self.path}'
+        page = self.server.archive.lookup(method, url)
+        if page is None and method == 'HEAD':
+            page = self.server.archive.lookup('GET', url)
+            if page:
+                page = page[0], None, b''
+
+        if page is None:
+            status, location, body = 404, None, b''
+        else:
+            status, location, body = page
+
+        self.send_response(status)
+        if location:
+            self.send_header('Location', location)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if method == 'GET':
+            self.wfile.write(body)
+
+        with self.server.lock:
+            self.server.hits.append((time.perf_counter(), method, url, len(body)))
+
+    def do_GET(self):
+        self.respond('GET')
+
+    def do_HEAD(self):
+        self.respond('HEAD')
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(archive, port=0):
+    """Serve the archive from a background thread. Returns the server, whose url attribute is the replay_url"""
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), ReplayHandler)
+    server.daemon_threads = True
+    server.archive = archive
+    server.lock = threading.Lock()
+    server.hits = []
+    server.url = f'http://127.0.0.1:{server.server_port}'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def get_replay_url(replay_url, url):
+    """Translate a real URL to the replay server, returning the new URL and the Host header to send"""
+    parsed = urllib.parse.urlparse(url)
+    new_url = replay_url.rstrip('/') + parsed.path
+    if parsed.query:
+        new_url += '?' + parsed.query
+    return new_url, parsed.netloc
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a recorded crawl (see crawl.py --record)')
+    parser.add_argument('archive')
+    parser.add_argument('-p', '--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    archive = ReplayArchive(args.archive)
+    server = start_server(archive, args.port)
+    click.secho(f'Serving {archive.count()} pages at {server.url} (use crawl.py --replay {server.url})',
+                fg='bright_green')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
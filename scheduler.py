@@ -0,0 +1,92 @@
+import datetime
+
+from pa_legislature import Chamber, NAMED_VOTES
+
+# What the database knows about an item after crawling it. If it differs before and after a refresh, the page changed.
+SIGNATURE_QUERIES = {
+    'session': 'SELECT date FROM session_days WHERE session_id=? ORDER BY date',
+    'day': 'SELECT number, name FROM roll_calls WHERE day_id=? ORDER BY number',
+    'roll': f'SELECT name, vote FROM {NAMED_VOTES} WHERE roll_id=? ORDER BY name',
+    'bio': 'SELECT year, chamber, district, party FROM service WHERE member_id=? ORDER BY year, chamber',
+}
+
+CANDIDATE_QUERIES = {
+    'session': 'SELECT * FROM sessions WHERE last_crawl IS NOT NULL',
+    'day': 'SELECT * FROM session_days WHERE last_crawl IS NOT NULL',
+    'roll': 'SELECT roll_calls.*, session_days.session_id FROM roll_calls '
+            'LEFT JOIN session_days ON roll_calls.day_id = session_days.id WHERE roll_calls.last_crawl IS NOT NULL',
+    'bio': 'SELECT * FROM members WHERE last_crawl IS NOT NULL',
+}
+
+
+def get_signature(db, kind, item_id):
+    return [tuple(row) for row in db.execute(SIGNATURE_QUERIES[kind], [item_id])]
+
+
+def record_refresh(db, kind, item_id, before, after):
+    stats = db.select_one('refreshes', clause={'kind': kind, 'item_id': item_id})
+    row = {'kind': kind, 'item_id': item_id}
+    if stats:
+        row['crawls'] = stats['crawls'] + 1
+        row['changes'] = stats['changes']
+    else:
+        row['crawls'] = 1
+        row['changes'] = 0
+    if before != after:
+        row['changes'] += 1
+        row['last_change'] = datetime.datetime.now()
+    db.update('refreshes', row, ['kind', 'item_id'])
+
+
+def get_open_session_ids(db):
+    """The sessions that can still change, i.e. those in the latest year for each chamber"""
+    open_ids = set()
+    for chamber in Chamber:
+        year = db.lookup('MAX(year)', 'sessions', {'chamber': chamber})
+        if year is not None:
+            open_ids.update(db.lookup_all('id', 'sessions', {'chamber': chamber, 'year': year}))
+    return open_ids
+
+
+def change_rate(stats, is_open):
+    """Estimated chance that a refresh finds a change.
+
+    Open items get a prior that assumes change is possible. Closed items only score if a change was ever observed."""
+    crawls, changes = stats
+    if is_open:
+        return (changes + 1) / (crawls + 2)
+    return changes / (crawls + 1)
+
+
+def plan_refreshes(db, budget, min_age=datetime.timedelta(days=1)):
+    """Return the (kind, row) pairs most worth recrawling, highest value first.
+
+    The value of refreshing an item is the age of its last crawl (in days) times its estimated change rate."""
+    now = datetime.datetime.now()
+    open_session_ids = get_open_session_ids(db)
+    latest_year = db.lookup('MAX(year)', 'sessions')
+    current_member_ids = set(db.lookup_all('member_id', 'service', {'year': latest_year}, distinct=True))
+
+    stats = {}
+    for row in db.query('SELECT * FROM refreshes'):
+        stats[row['kind'], row['item_id']] = row['crawls'], row['changes']
+
+    scored = []
+    for kind, query in CANDIDATE_QUERIES.items():
+        for row in db.query(query):
+            age = now - row['last_crawl']
+            if age < min_age:
+                continue
+            if kind == 'session':
+                is_open = row['id'] in open_session_ids
+            elif kind == 'bio':
+                is_open = row['id'] in current_member_ids
+            else:
+                is_open = row['session_id'] in open_session_ids
+
+            score = age / datetime.timedelta(days=1) * change_rate(stats.get((kind, row['id']), (0, 0)), is_open)
+            if score > 0:
+                scored.append((score, kind, row))
+
+    scored.sort(key=lambda t: t[0], reverse=True)
+    return [(kind, row) for score, kind, row in scored[:budget]]
@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+"""Load the vote_data csvs (see the README for the format) as NumPy arrays.
+
+The first load of each csv writes sidecar files next to it: {stem}.votes.npy, {stem}.rolls.npy and
+{stem}.legislators.npy, and {stem}.cache.json with the sha1 of the csv they came from. Later loads memory-map the
+votes instead of parsing the csv, until the csv's hash changes. The hash is only recomputed when the csv's size or
+modification time changes.
+"""
+import argparse
+import click
+import csv
+import hashlib
+import json
+import numpy
+import pathlib
+import time
+
+from pa_legislature import Chamber, VOTE_CODES
+
+ROOT_FOLDER = pathlib.Path('vote_data')
+
+# Bump this when the layout of the arrays changes, to discard the existing caches
+CACHE_VERSION = 1
+SIDECARS = ['votes', 'rolls', 'legislators']
+
+NO_RECORD = 0  # The Vote values start at 1
+
+
+def get_sidecar_path(path, suffix):
+    return path.with_name(f'{path.stem}.{suffix}')
+
+
+def get_hash(path):
+    return hashlib.sha1(path.read_bytes()).hexdigest()
+
+
+def parse_csv(path):
+    """Return the votes, rolls and legislators of one csv, without using the cache.
+
+    votes is an int8 matrix with a row per roll and a column per legislator, with the Vote values or NO_RECORD.
+    rolls is a structured array of name, number, stamp (datetime64[s]) and timed (False if the csv only has the date).
+    legislators is a structured array of name, district (0 if not known) and party"""
+    with open(path, newline='') as f:
+        rows = list(csv.reader(f))
+
+    names = rows[0][3:]
+    districts = [0] * len(names)
+    parties = [''] * len(names)
+    start = 1
+    while start < len(rows) and rows[start][0] in ['District', 'Party']:
+        if rows[start][0] == 'District':
+            districts = [int(s) if s else 0 for s in rows[start][3:]]
+        else:
+            parties = rows[start][3:]
+        start += 1
+    roll_rows = rows[start:]
+
+    legislators = numpy.array(list(zip(names, districts, parties)), dtype=[
+        ('name', f'U{max(map(len, names), default=1)}'),
+        ('district', 'i2'),
+        ('party', f'U{max(map(len, parties), default=1)}'),
+    ])
+    rolls = numpy.array([(row[0], int(row[1]), row[2], len(row[2]) > 10) for row in roll_rows], dtype=[
+        ('name', f'U{max((len(row[0]) for row in roll_rows), default=1)}'),
+        ('number', 'i4'),
+        ('stamp', 'datetime64[s]'),
+        ('timed', '?'),
+    ])
+
+    letters = numpy.array([row[3:] for row in roll_rows], dtype='U1').reshape(len(roll_rows), len(names))
+    votes = numpy.full(letters.shape, NO_RECORD, dtype=numpy.int8)
+    for letter, vote in VOTE_CODES.items():
+        votes[letters == letter] = int(vote)
+    return votes, rolls, legislators
+
+
+def load_vote_matrix(path, use_cache=True):
+    """Return the votes, rolls and legislators of one csv (see parse_csv), from its sidecar cache if it is current.
+
+    With the cache, votes is a read-only memory map"""
+    path = pathlib.Path(path)
+    if not use_cache:
+        return parse_csv(path)
+
+    stat = path.stat()
+    info_path = get_sidecar_path(path, 'cache.json')
+    info = json.load(open(info_path)) if info_path.exists() else {}
+    if info.get('version') == CACHE_VERSION and all(get_sidecar_path(path, f'{sidecar}.npy').exists()
+                                                    for sidecar in SIDECARS):
+        if info['size'] != stat.st_size or info['mtime_ns'] != stat.st_mtime_ns:
+            # Rewritten (or checked out again), but possibly with the same contents
+            if info['sha1'] == get_hash(path):
+                info.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+                with open(info_path, 'w') as f:
+                    json.dump(info, f)
+            else:
+                info = {}
+        if info:
+            return (numpy.load(get_sidecar_path(path, 'votes.npy'), mmap_mode='r'),
+                    numpy.load(get_sidecar_path(path, 'rolls.npy')),
+                    numpy.load(get_sidecar_path(path, 'legislators.npy')))
+
+    arrays = parse_csv(path)
+    for sidecar, array in zip(SIDECARS, arrays):
+        numpy.save(get_sidecar_path(path, f'{sidecar}.npy'), array)
+    info = {'version': CACHE_VERSION, 'sha1': get_hash(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    # Written last, so that an interrupted write leaves a cache that is not used
+    with open(info_path, 'w') as f:
+        json.dump(info, f)
+    return arrays
+
+
+def load_all(root_folder=ROOT_FOLDER, use_cache=True):
+    """Map each (year, chamber) in the root_folder to the load_vote_matrix of its csv"""
+    results = {}
+    for path in sorted(pathlib.Path(root_folder).glob('*/*.csv')):
+        results[int(path.parent.name), Chamber[path.stem.upper()]] = load_vote_matrix(path, use_cache)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load every vote_data csv, using (and writing) the sidecar caches')
+    parser.add_argument('root_folder', nargs='?', default=ROOT_FOLDER, type=pathlib.Path)
+    parser.add_argument('-n', '--no-cache', action='store_true', help='Parse every csv, ignoring the caches')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    matrices = load_all(args.root_folder, not args.no_cache)
+    seconds = time.perf_counter() - start
+    n_votes = sum(int((votes != NO_RECORD).sum()) for votes, rolls, legislators in matrices.values())
+    click.secho(f'Loaded {len(matrices)} files ({n_votes} votes) in {1000 * seconds:.1f} ms', fg='bright_white')
@@ -0,0 +1,54 @@
+import datetime
+
+KINDS = ['session', 'day', 'roll', 'member_list', 'bio']
+MAX_ATTEMPTS = 3
+
+
+def enqueue(db, kind, item_id=None, name=None):
+    """Add a task unless the same one is already waiting to be done (tasks that failed do not count)"""
+    if kind not in KINDS:
+        raise RuntimeError(f'Unknown task kind {repr(kind)}')
+    task = {'kind': kind, 'item_id': item_id, 'name': name, 'completed': None, 'failed': None}
+    if db.count('work_queue', task):
+        return False
+    task['attempts'] = 0
+    db.insert('work_queue', task)
+    return True
+
+
+def claim(db, owner, lease=datetime.timedelta(minutes=10)):
+    """Lease the oldest available task to owner, and commit so that other workers see the claim.
+
+    A task is available if it is not complete, and it was never leased or its lease has expired
+    (i.e. the worker holding it crashed). Returns None when there is nothing left to do."""
+    now = datetime.datetime.now()
+    # Tasks whose last attempt was abandoned will not be claimed again
+    db.execute('UPDATE work_queue SET failed=?, lease_expires=NULL WHERE completed IS NULL AND failed IS NULL'
+               ' AND attempts >= ? AND lease_expires < ?', [now, MAX_ATTEMPTS, now])
+    cursor = db.execute('UPDATE work_queue SET owner=?, lease_expires=?, attempts=attempts+1 WHERE id = ('
+                        ' SELECT id FROM work_queue WHERE completed IS NULL AND failed IS NULL AND attempts < ?'
+                        ' AND (lease_expires IS NULL OR lease_expires < ?) ORDER BY id LIMIT 1'
+                        ') RETURNING *', [owner, now + lease, MAX_ATTEMPTS, now])
+    task = cursor.fetchone()
+    db.write()
+    return task
+
+
+def complete(db, task):
+    db.execute('UPDATE work_queue SET completed=?, lease_expires=NULL WHERE id=? AND owner=?',
+               [datetime.datetime.now(), task['id'], task['owner']])
+    db.write()
+
+
+def release(db, task):
+    """Give up the lease on a task that raised an error, so that it can be retried right away.
+
+    After MAX_ATTEMPTS the task is marked as failed instead, and can then be enqueued again"""
+    failed = datetime.datetime.now() if task['attempts'] >= MAX_ATTEMPTS else None
+    db.execute('UPDATE work_queue SET failed=?, lease_expires=NULL WHERE id=? AND owner=?',
+               [failed, task['id'], task['owner']])
+    db.write()
+
+
+def pending_count(db):
+    return db.count('work_queue', {'completed': None, 'failed': None})